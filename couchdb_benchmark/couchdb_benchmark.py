@@ -9,16 +9,27 @@
     e-mail: xpm.pub@gmail.com'''
 
 
+import sys
+import csv
 import json
 import logging
 import getpass
 import argparse
 import re
+import os
 import urllib
 import couchdb
 import string
 import time
+import math
+import datetime
+import statistics
+import threading
 import requests
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from random import *
 from lockfile import FileLock, LockTimeout, AlreadyLocked
 from logging import handlers
@@ -32,28 +43,827 @@ class ContextFilter(logging.Filter):
         record.user = getpass.getuser()
         return True
 
-def gen_string(minlen, maxlen):
-    try:
-        allchar = string.ascii_letters + string.digits
-        result = "".join(choice(allchar) for x in range(randint(minlen, maxlen)))
-    except Exception as e:
-        logger.info(type(e))
-        logger.info('Error: %s' % e)
-    finally:
-        return result
+#translation table from random bytes to letters and digits
+ALLCHAR = (string.ascii_letters + string.digits).encode('ascii')
+ALLCHAR_TABLE = bytes(ALLCHAR[i % len(ALLCHAR)] for i in range(256))
+
+class PayloadFactory(object):
+    #Generates pre-serialized JSON bodies of test documents by blocks.
+    #Random field values for the whole block are sliced from one random bytes buffer,
+    #with seed every block is generated from own seeded generator, so bodies depend
+    #only on document number and repeated runs send byte-identical workload.
+
+    def __init__(self, docsnum, fieldsnum, blocksize, seed=None, minlen=8, maxlen=12):
+        self.docsnum = docsnum
+        self.fieldsnum = fieldsnum
+        self.blocksize = blocksize
+        self.seed = seed
+        self.minlen = minlen
+        self.maxlen = maxlen
+        self.prefixes = ['"field%i": "' % fieldnum for fieldnum in range(fieldsnum)]
+
+    def blocksnum(self):
+        return (self.docsnum + self.blocksize - 1) // self.blocksize
+
+    def random_bytes(self, blocknum, n):
+        if self.seed is None:
+            return os.urandom(n)
+        return Random('%s:%i' % (self.seed, blocknum)).randbytes(n)
+
+    def block(self, blocknum):
+        #list of JSON bodies of documents with numbers from blocknum*blocksize
+        count = min(self.blocksize, self.docsnum - blocknum * self.blocksize)
+        strings = count * self.fieldsnum
+        raw = self.random_bytes(blocknum, strings * (self.maxlen + 1))
+        #first bytes are used for string lengths, others are mapped to letters and digits
+        lengths = raw[:strings]
+        chars = raw[strings:].translate(ALLCHAR_TABLE).decode('ascii')
+        spread = self.maxlen - self.minlen + 1
+        bodies = []
+        pos = 0
+        n = 0
+        for docnum in range(count):
+            fields = []
+            for prefix in self.prefixes:
+                length = self.minlen + lengths[n] % spread
+                fields.append(prefix + chars[pos:pos+length] + '"')
+                pos += length
+                n += 1
+            bodies.append(('{' + ', '.join(fields) + '}').encode('ascii'))
+        return bodies
+
+class LatencyHistogram(object):
+    #Fixed memory log-linear latency histogram (HDR-like).
+    #Latencies are recorded in microseconds, values below 2^subbits are exact,
+    #bigger values fall in buckets with relative error less than 1/2^(subbits-1).
+    #Memory usage does not depend on number of recorded values.
+
+    def __init__(self, subbits=8, maxbits=36):
+        self.subbits = subbits
+        self.half = 1 << (subbits - 1)
+        self.maxbits = maxbits
+        self.counts = array('Q', bytes(8 * (maxbits - subbits + 2) * self.half))
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        #number of recorded values per second of monotonic clock for throughput time series
+        self.timeline = Counter()
+
+    def index(self, value):
+        #bucket index of value in microseconds
+        shift = max(0, min(value.bit_length(), self.maxbits) - self.subbits)
+        mantissa = min(value >> shift, (self.half << 1) - 1)
+        return shift * self.half + mantissa
+
+    def value(self, index):
+        #middle value in microseconds of bucket with index
+        if index < (self.half << 1):
+            return index
+        shift = index // self.half - 1
+        mantissa = index - shift * self.half
+        return (mantissa << shift) + (1 << (shift - 1))
+
+    def record(self, t):
+        #add latency t in seconds to histogram
+        self.counts[self.index(int(t * 1000000))] += 1
+        self.count += 1
+        self.sum += t
+        if t > self.max:
+            self.max = t
+        self.timeline[int(time.monotonic())] += 1
+
+    def merge(self, other):
+        #add all values from other histogram
+        for i, c in enumerate(other.counts):
+            if c:
+                self.counts[i] += c
+        self.count += other.count
+        self.sum += other.sum
+        if other.max > self.max:
+            self.max = other.max
+        self.timeline.update(other.timeline)
+        return self
+
+    def average(self):
+        return self.sum/self.count if self.count else 0.0
+
+    def value_at(self, rank):
+        #latency in seconds of value with rank (from 1 to count) in sorted order
+        if rank >= self.count:
+            return self.max
+        total = 0
+        for i, c in enumerate(self.counts):
+            total += c
+            if total >= rank:
+                return min(self.value(i) / 1000000.0, self.max)
+        return self.max
+
+    def percentile(self, p):
+        #latency in seconds below which p percent of recorded values are
+        if not self.count:
+            return 0.0
+        return self.value_at(max(1, math.ceil(self.count * p / 100.0)))
+
+    def percentile_interval(self, p, z=1.96):
+        #approximate confidence interval of percentile from binomial distribution of its rank
+        if not self.count:
+            return 0.0, 0.0
+        q = p / 100.0
+        spread = z * math.sqrt(self.count * q * (1 - q))
+        return self.value_at(max(1, math.floor(self.count * q - spread))), self.value_at(max(1, math.ceil(self.count * q + spread)))
+
+    def throughput_series(self):
+        #number of recorded values in every second from first to last one
+        if not self.timeline:
+            return []
+        first = min(self.timeline)
+        return [self.timeline.get(second, 0) for second in range(first, max(self.timeline) + 1)]
+
+    def to_dict(self):
+        #compact representation with non empty buckets only
+        return {'subbits': self.subbits, 'maxbits': self.maxbits, 'count': self.count, 'sum': self.sum, 'max': self.max,
+                'buckets': [[i, c] for i, c in enumerate(self.counts) if c]}
+
+    @classmethod
+    def from_dict(cls, data):
+        hist = cls(data['subbits'], data['maxbits'])
+        for i, c in data['buckets']:
+            hist.counts[i] = c
+        hist.count = data['count']
+        hist.sum = data['sum']
+        hist.max = data['max']
+        return hist
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+def format_latency(hist):
+    #one line summary of latency distribution in milliseconds
+    return "  ".join(["p%s:%.3fms" % (('%g' % p), hist.percentile(p)*1000) for p in PERCENTILES] + ["max:%.3fms" % (hist.max*1000)])
+
+def make_session(concurrency):
+    #one http session with connection pool shared by all worker threads
+    #one more connection is used by index build request while workers write documents
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency + 1)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'Content-Type': 'application/json', 'Accept': 'application/json'})
+    return session
+
+class Schedule(object):
+    #Open-loop timetable of requests with constant rate shared by all worker threads.
+    #Every request gets own intended send time regardless of previous responses,
+    #so latency measured from intended time includes queueing delay (coordinated omission).
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.start = None
+        self.n = 0
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            if self.start is None:
+                self.start = time.perf_counter()
+            t = self.start + self.n * self.interval
+            self.n += 1
+        return t
+
+def start_time(schedule):
+    #start time of request for latency calculation
+    #in open-loop mode waits for intended send time and returns it
+    if schedule is None:
+        return time.perf_counter()
+    t = schedule.next()
+    delay = t - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+    return t
+
+def prefetch(func, items, schedule):
+    #yields item and func(item) for every item
+    #in open-loop mode result for next item is prepared by background thread while current one is sent,
+    #so payload generation is not counted as waiting for intended send time
+    if schedule is None:
+        for item in items:
+            yield item, func(item)
+        return
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = None
+        for item in items:
+            next_future = (item, executor.submit(func, item))
+            if future is not None:
+                yield future[0], future[1].result()
+            future = next_future
+        if future is not None:
+            yield future[0], future[1].result()
+
+def run_workers(worker, items, concurrency):
+    #split items between worker threads and run them in parallel
+    #in open-loop mode (--rate) all workers share one requests schedule
+    #returns list of worker results and wall clock time of all workers
+    schedule = Schedule(args.rate) if args.rate else None
+    ts = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(worker, items[i::concurrency], schedule) for i in range(concurrency)]
+        results = [future.result() for future in futures]
+    tf = time.perf_counter()
+    return results, tf-ts
+
+def write_worker(session, db_url, factory, blocknums, schedule):
+    #write documents and return latency histogram and counters
+    hist = LatencyHistogram()
+    counters = Counter()
+    params = {'w': args.wq} if args.wq else None
+    for blocknum, block in prefetch(factory.block, blocknums, schedule):
+        for body in block:
+            #calculating time need for writing document in instance
+            ts = start_time(schedule)
+            r = session.post(db_url, data=body, params=params)
+            tf = time.perf_counter()
+            #add spent time to histogram if document created
+            if r.status_code in (201, 202):
+                hist.record(tf-ts)
+            else:
+                counters['failed documents'] += 1
+    return hist, counters
+
+def bulk_body(docs):
+    #documents and _bulk_docs request body
+    return docs, b'{"docs": [' + b', '.join(docs) + b']}'
+
+def bulk_write_worker(session, db_url, factory, batchnums, schedule):
+    #write documents through _bulk_docs and return per batch latency histogram and counters
+    #factory block size is equal to batch size
+    hist = LatencyHistogram()
+    counters = Counter()
+    params = {'w': args.wq} if args.wq else None
+    for batchnum, (docs, body) in prefetch(lambda batchnum: bulk_body(factory.block(batchnum)), batchnums, schedule):
+        #calculating time need for writing batch in instance
+        ts = start_time(schedule)
+        r = session.post('%s/_bulk_docs' % db_url, data=body, params=params)
+        tf = time.perf_counter()
+        #_bulk_docs returns 417 if some documents was rejected, but other documents are saved
+        if r.status_code in (201, 202, 417):
+            hist.record(tf-ts)
+            for result in r.json():
+                if 'error' not in result:
+                    counters['documents'] += 1
+                elif result['error'] == 'conflict':
+                    counters['conflicts'] += 1
+                else:
+                    counters['failed documents'] += 1
+        else:
+            counters['failed batches'] += 1
+            counters['failed documents'] += len(docs)
+    return hist, counters
+
+def read_worker(session, db_url, docids, schedule):
+    #read documents and return latency histogram and counters
+    hist = LatencyHistogram()
+    counters = Counter()
+    params = {'r': args.rq} if args.rq else None
+    for docid in docids:
+        #calculating time need for reading document from instance
+        ts = start_time(schedule)
+        r = session.get('%s/%s' % (db_url,urllib.parse.quote(docid,safe='')), params=params)
+        tf = time.perf_counter()
+        if r.status_code == 200 and len(r.content) > 0:
+            hist.record(tf-ts)
+        else:
+            counters['failed documents'] += 1
+    return hist, counters
+
+def all_docs_worker(session, db_url, ranges, schedule):
+    #read documents by pages through _all_docs?include_docs=true with limit/startkey pagination
+    #every range is (startkey, endkey) pair of document ids
+    hist = LatencyHistogram()
+    counters = Counter()
+    for startkey, endkey in ranges:
+        #request one more row, its id is a startkey of next page
+        params = {'include_docs': 'true', 'limit': args.pagesize + 1, 'startkey': json.dumps(startkey), 'endkey': json.dumps(endkey)}
+        while True:
+            ts = start_time(schedule)
+            r = session.get('%s/_all_docs' % db_url, params=params)
+            tf = time.perf_counter()
+            if r.status_code != 200:
+                counters['failed pages'] += 1
+                break
+            hist.record(tf-ts)
+            rows = r.json()['rows']
+            for row in rows[:args.pagesize]:
+                if row.get('doc') is not None:
+                    counters['documents'] += 1
+            if len(rows) <= args.pagesize:
+                break
+            params['startkey'] = json.dumps(rows[-1]['id'])
+    return hist, counters
+
+def keys_worker(session, db_url, pages, schedule):
+    #read documents by pages through POST _all_docs?include_docs=true with keys
+    hist = LatencyHistogram()
+    counters = Counter()
+    for keys in pages:
+        body = json.dumps({'keys': keys})
+        ts = start_time(schedule)
+        r = session.post('%s/_all_docs' % db_url, data=body, params={'include_docs': 'true'})
+        tf = time.perf_counter()
+        if r.status_code != 200:
+            counters['failed pages'] += 1
+            continue
+        hist.record(tf-ts)
+        for row in r.json()['rows']:
+            if row.get('doc') is not None:
+                counters['documents'] += 1
+            else:
+                counters['missing documents'] += 1
+    return hist, counters
+
+def bulk_get_worker(session, db_url, pages, schedule):
+    #read documents by pages through POST _bulk_get
+    hist = LatencyHistogram()
+    counters = Counter()
+    for keys in pages:
+        body = json.dumps({'docs': [{'id': key} for key in keys]})
+        ts = start_time(schedule)
+        r = session.post('%s/_bulk_get' % db_url, data=body)
+        tf = time.perf_counter()
+        if r.status_code != 200:
+            counters['failed pages'] += 1
+            continue
+        hist.record(tf-ts)
+        for result in r.json()['results']:
+            for doc in result['docs']:
+                if 'ok' in doc:
+                    counters['documents'] += 1
+                else:
+                    counters['missing documents'] += 1
+    return hist, counters
+
+def read_test(session, db_url, docids, mode):
+    #run read perfomance test in selected mode, docids must be sorted as in _all_docs
+    if mode == 'all_docs':
+        #every worker paginates own continuous range of ids
+        chunk = max(1, -(-len(docids) // args.concurrency))
+        ranges = [(docids[i], docids[min(i+chunk, len(docids))-1]) for i in range(0, len(docids), chunk)]
+        results, walltime = run_workers(lambda ranges, schedule: all_docs_worker(session, db_url, ranges, schedule), ranges, args.concurrency)
+    elif mode in ('keys', 'bulk_get'):
+        pages = [docids[i:i+args.pagesize] for i in range(0, len(docids), args.pagesize)]
+        worker = keys_worker if mode == 'keys' else bulk_get_worker
+        results, walltime = run_workers(lambda pages, schedule: worker(session, db_url, pages, schedule), pages, args.concurrency)
+    else:
+        results, walltime = run_workers(lambda docids, schedule: read_worker(session, db_url, docids, schedule), docids, args.concurrency)
+    hist, counters = summarize(results)
+    return hist, counters, walltime, ('documents' if mode == 'single' else 'pages')
+
+#YCSB-like workload profiles: operations ratio and default key distribution
+WORKLOADS = {
+    'a': ({'read': 50, 'update': 50}, 'zipfian'),
+    'b': ({'read': 95, 'update': 5}, 'zipfian'),
+    'c': ({'read': 100}, 'zipfian'),
+    'd': ({'read': 95, 'insert': 5}, 'latest'),
+    'mixed': ({'read': 60, 'insert': 15, 'update': 15, 'delete': 10}, 'uniform'),
+}
+
+WORKLOAD_OPERATIONS = ('read', 'insert', 'update', 'delete')
+
+def parse_workload(workload):
+    #profile name or custom ratio like "read=70,update=20,delete=10"
+    if workload in WORKLOADS:
+        return WORKLOADS[workload]
+    if '=' not in workload:
+        raise ValueError('unknown workload profile "%s", use %s or ratio like read=70,update=30' % (workload, ', '.join(sorted(WORKLOADS))))
+    mix = {}
+    for item in workload.split(','):
+        operation, sep, ratio = item.partition('=')
+        if operation.strip() not in WORKLOAD_OPERATIONS:
+            raise ValueError('unknown workload operation "%s", use %s' % (operation.strip(), ', '.join(WORKLOAD_OPERATIONS)))
+        try:
+            mix[operation.strip()] = float(ratio)
+        except ValueError:
+            raise ValueError('invalid ratio "%s" of workload operation "%s"' % (ratio, operation.strip()))
+    if sum(mix.values()) <= 0:
+        raise ValueError('workload "%s" has no operations' % workload)
+    return mix, 'uniform'
+
+class ZipfianGenerator(object):
+    #Zipfian distributed numbers in range [0, items) as in YCSB (Gray et al.),
+    #small numbers are the most popular. Generator state is read only, so one
+    #generator can be shared by all worker threads with own random generators.
+
+    def __init__(self, items, theta=0.99):
+        self.items = items
+        self.theta = theta
+        self.zetan = sum(1.0 / (i + 1) ** theta for i in range(items))
+        self.zeta2 = 1.0 + 0.5 ** theta
+        self.alpha = 1.0 / (1.0 - theta)
+        #with one or two items next() returns from the first two branches and eta is not used
+        self.eta = (1.0 - (2.0 / items) ** (1.0 - theta)) / (1.0 - self.zeta2 / self.zetan) if items > 2 else 0.0
+
+    def next(self, rng):
+        u = rng.random()
+        uz = u * self.zetan
+        if uz < 1.0:
+            return 0
+        if uz < self.zeta2:
+            return 1
+        return min(self.items - 1, int(self.items * (self.eta * u - self.eta + 1.0) ** self.alpha))
+
+class KeySpace(object):
+    #Shared list of test documents ids with last known revisions.
+    #Revision of deleted document is None.
+
+    def __init__(self, rows):
+        self.ids = [row[0] for row in rows]
+        self.revs = [row[1] for row in rows]
+        self.lock = threading.Lock()
+
+    def size(self):
+        return len(self.ids)
+
+    def add(self, docid, rev):
+        #revision is added first, so concurrent choose() which reads size of ids always has revision of chosen index
+        with self.lock:
+            self.revs.append(rev)
+            self.ids.append(docid)
+
+    def choose(self, distribution, zipfian, rng):
+        #index of document selected with distribution, None for empty key space
+        size = len(self.ids)
+        if not size:
+            return None
+        if distribution == 'uniform' or zipfian is None:
+            return rng.randrange(size)
+        elif distribution == 'latest':
+            #recently inserted documents are the most popular
+            return max(0, size - 1 - zipfian.next(rng))
+        return min(size - 1, zipfian.next(rng))
+
+def workload_worker(session, db_url, keyspace, mix, distribution, zipfian, factory, opnums, schedule):
+    #run mixed workload operations and return latency histogram and counters for every operation
+    results = dict((operation, (LatencyHistogram(), Counter())) for operation in WORKLOAD_OPERATIONS)
+    workernum = opnums[0] if len(opnums) else 0
+    rng = Random('%s:workload:%i' % (args.seed, workernum)) if args.seed is not None else Random()
+    bodies = factory.block(workernum)
+    operations = list(mix)
+    cum_weights = []
+    total = 0
+    for operation in operations:
+        total += mix[operation]
+        cum_weights.append(total)
+    wparams = {'w': args.wq} if args.wq else {}
+    rparams = {'r': args.rq} if args.rq else {}
+    for opnum in opnums:
+        operation = rng.choices(operations, cum_weights=cum_weights)[0]
+        hist, counters = results[operation]
+        body = bodies[opnum % len(bodies)]
+        if operation == 'insert':
+            ts = start_time(schedule)
+            r = session.post(db_url, data=body, params=wparams)
+            tf = time.perf_counter()
+            if r.status_code in (201, 202):
+                hist.record(tf-ts)
+                result = r.json()
+                keyspace.add(result['id'], result['rev'])
+            else:
+                counters['failed requests'] += 1
+            continue
+        index = keyspace.choose(distribution, zipfian, rng)
+        if index is None:
+            #no documents to read, update or delete yet
+            counters['missing documents'] += 1
+            continue
+        docid = keyspace.ids[index]
+        rev = keyspace.revs[index]
+        doc_url = '%s/%s' % (db_url,urllib.parse.quote(docid,safe=''))
+        if operation == 'read':
+            ts = start_time(schedule)
+            r = session.get(doc_url, params=rparams)
+            tf = time.perf_counter()
+        elif rev is None:
+            #document already deleted
+            counters['missing documents'] += 1
+            continue
+        elif operation == 'update':
+            ts = start_time(schedule)
+            r = session.put(doc_url, data=b'{"_rev": "' + rev.encode('ascii') + b'", ' + body[1:], params=wparams)
+            tf = time.perf_counter()
+        else:
+            params = dict(wparams, rev=rev)
+            ts = start_time(schedule)
+            r = session.delete(doc_url, params=params)
+            tf = time.perf_counter()
+        if r.status_code in (200, 201, 202):
+            hist.record(tf-ts)
+            if operation == 'update':
+                keyspace.revs[index] = r.json()['rev']
+            elif operation == 'delete':
+                keyspace.revs[index] = None
+        elif r.status_code == 404:
+            counters['missing documents'] += 1
+        elif r.status_code == 409:
+            #document was changed by another worker, refresh known revision outside of measurement
+            counters['conflicts'] += 1
+            h = session.head(doc_url)
+            keyspace.revs[index] = h.headers['ETag'].strip('"') if h.status_code == 200 else None
+        else:
+            counters['failed requests'] += 1
+    return results
+
+def workload_test(session, db, db_url):
+    #run mixed workload on loaded data and return test phases for every operation and total
+    mix, distribution = parse_workload(args.workload)
+    if args.distribution:
+        distribution = args.distribution
+    rows = [(row.id, row.value['rev']) for row in db.view('_all_docs') if not row.id.startswith('_design/')]
+    keyspace = KeySpace(rows)
+    #zipfian generator is only needed for zipfian and latest distributions of loaded documents
+    zipfian = ZipfianGenerator(keyspace.size()) if distribution in ('zipfian', 'latest') and keyspace.size() else None
+    operations = args.operations or args.docsnum
+    factory = PayloadFactory(args.concurrency * 1000, args.fieldsnum, 1000, args.seed)
+    results, walltime = run_workers(lambda opnums, schedule: workload_worker(session, db_url, keyspace, mix, distribution, zipfian, factory, opnums, schedule), range(operations), args.concurrency)
+    phases = []
+    total = LatencyHistogram()
+    totalcounters = Counter()
+    for operation in WORKLOAD_OPERATIONS:
+        if operation in mix:
+            hist, counters = summarize([result[operation] for result in results])
+            total.merge(hist)
+            totalcounters.update(counters)
+            phases.append(("Workload %s, %s distribution (%s)" % (args.workload, distribution, operation), hist, counters, walltime, 'operations'))
+    phases.append(("Workload %s, %s distribution (total)" % (args.workload, distribution), total, totalcounters, walltime, 'operations'))
+    return phases
+
+#default design document for view tests, array keys allow group_level=1 queries
+DEFAULT_DESIGN = {
+    '_id': '_design/benchmark',
+    'language': 'javascript',
+    'views': {
+        'by_field0': {
+            'map': 'function(doc) { if (doc.field0) { emit([doc.field0.charAt(0), doc.field0], 1); } }',
+            'reduce': '_count',
+        },
+    },
+}
+
+def background_write_worker(session, db_url, factory, stop, blocknums, schedule):
+    #write documents until stop event is set and return latency histogram and counters
+    hist = LatencyHistogram()
+    counters = Counter()
+    params = {'w': args.wq} if args.wq else None
+    while not stop.is_set():
+        for blocknum in blocknums:
+            for body in factory.block(blocknum):
+                if stop.is_set():
+                    return hist, counters
+                ts = time.perf_counter()
+                r = session.post(db_url, data=body, params=params)
+                tf = time.perf_counter()
+                if r.status_code in (201, 202):
+                    hist.record(tf-ts)
+                else:
+                    counters['failed documents'] += 1
+    return hist, counters
+
+def timed_build(session, db_url, title, build):
+    #time index build request made by build() while workers continue writing documents
+    #returns test phases of build and of background writes
+    stop = threading.Event()
+    factory = PayloadFactory(args.concurrency * 1000, args.fieldsnum, 1000, args.seed)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        writers = executor.submit(run_workers, lambda blocknums, schedule: background_write_worker(session, db_url, factory, stop, blocknums, None), range(args.concurrency), args.concurrency)
+        ts = time.perf_counter()
+        try:
+            r = build()
+        finally:
+            tf = time.perf_counter()
+            stop.set()
+        results, walltime = writers.result()
+    whist, wcounters = summarize(results)
+    hist = LatencyHistogram()
+    counters = Counter()
+    if r.status_code == 200:
+        hist.record(tf-ts)
+        #number of indexed rows gives indexing rate
+        if 'total_rows' in r.json():
+            counters['documents'] = r.json()['total_rows']
+    else:
+        counters['failed builds'] += 1
+    return [(title, hist, counters, tf-ts, 'builds'),
+            ("Writes during %s%s" % (title[0].lower(), title[1:]), whist, wcounters, walltime, 'documents')]
+
+def query_worker(session, make_query, opnums, schedule):
+    #run queries made by make_query(rng) and return latency histogram and counters
+    hist = LatencyHistogram()
+    counters = Counter()
+    workernum = opnums[0] if len(opnums) else 0
+    rng = Random('%s:query:%i' % (args.seed, workernum)) if args.seed is not None else Random()
+    for opnum in opnums:
+        method, url, params, body = make_query(rng)
+        ts = start_time(schedule)
+        r = session.request(method, url, params=params, data=body)
+        tf = time.perf_counter()
+        if r.status_code == 200:
+            hist.record(tf-ts)
+            result = r.json()
+            counters['rows'] += len(result.get('rows', result.get('docs', [])))
+        else:
+            counters['failed queries'] += 1
+    return hist, counters
+
+def query_test(session, title, make_query):
+    results, walltime = run_workers(lambda opnums, schedule: query_worker(session, make_query, opnums, schedule), range(args.queries), args.concurrency)
+    hist, counters = summarize(results)
+    return (title, hist, counters, walltime, 'queries')
+
+def view_test(session, db_url):
+    #install design document, time index build and benchmark view and mango queries
+    if args.designfile:
+        with open(args.designfile) as f:
+            design = json.load(f)
+    else:
+        design = DEFAULT_DESIGN
+    ddoc_id = design.setdefault('_id', '_design/benchmark')
+    ddoc_url = '%s/%s' % (db_url,urllib.parse.quote(ddoc_id,safe='/'))
+    r = session.put(ddoc_url, data=json.dumps(design))
+    if r.status_code not in (201, 202):
+        print("Error creating design document! Response status code: %i." % r.status_code)
+        return []
+    phases = []
+    views = design.get('views', {})
+    for name in sorted(views):
+        view_url = '%s/_view/%s' % (ddoc_url,urllib.parse.quote(name,safe=''))
+        reduce = 'reduce' in views[name]
+        noreduce = {'reduce': 'false'} if reduce else {}
+        #all views of design document are built together by first query
+        if not phases:
+            phases.extend(timed_build(session, db_url, "View index build (%s)" % ddoc_id,
+                                      lambda: session.get(view_url, params=dict(noreduce, limit=0))))
+        #view keys sample in collation order
+        keys = [row['key'] for row in session.get(view_url, params=dict(noreduce, limit=1000)).json()['rows']]
+        if not keys:
+            continue
+        phases.append(query_test(session, "View %s query (key)" % name,
+            lambda rng: ('GET', view_url, dict(noreduce, key=json.dumps(rng.choice(keys))), None)))
+        phases.append(query_test(session, "View %s query (range)" % name,
+            lambda rng: ('GET', view_url, dict(noreduce, startkey=json.dumps(rng.choice(keys)), limit=args.pagesize), None)))
+        if reduce:
+            def reduce_query(rng):
+                first, last = sorted(rng.sample(range(len(keys)), 2)) if len(keys) > 1 else (0, 0)
+                return ('GET', view_url, {'startkey': json.dumps(keys[first]), 'endkey': json.dumps(keys[last])}, None)
+            phases.append(query_test(session, "View %s query (reduce)" % name, reduce_query))
+            group = {'group_level': 1} if isinstance(keys[0], list) else {'group': 'true'}
+            phases.append(query_test(session, "View %s query (group)" % name,
+                lambda rng: ('GET', view_url, dict(group, limit=args.pagesize), None)))
+
+    #mango queries by field values from documents sample
+    field = args.mangofield
+    rows = session.get('%s/_all_docs' % db_url, params={'include_docs': 'true', 'limit': 1000}).json()['rows']
+    values = [row['doc'][field] for row in rows if row.get('doc') and field in row['doc']]
+    if values:
+        phases.append(query_test(session, "Mango _find query (no index)",
+            lambda rng: ('POST', '%s/_find' % db_url, None, json.dumps({'selector': {field: rng.choice(values)}, 'limit': args.pagesize}))))
+        use_index = ['benchmark-mango', 'by-%s' % field]
+        r = session.post('%s/_index' % db_url, data=json.dumps({'index': {'fields': [field]}, 'ddoc': use_index[0], 'name': use_index[1], 'type': 'json'}))
+        if r.status_code == 200:
+            #mango index is built by first query which uses it
+            phases.extend(timed_build(session, db_url, "Mango index build (%s)" % use_index[1],
+                lambda: session.post('%s/_find' % db_url, data=json.dumps({'selector': {field: values[0]}, 'use_index': use_index, 'limit': 1}))))
+            phases.append(query_test(session, "Mango _find query (index)",
+                lambda rng: ('POST', '%s/_find' % db_url, None, json.dumps({'selector': {field: rng.choice(values)}, 'use_index': use_index, 'limit': args.pagesize}))))
+        else:
+            print("Error creating mango index! Response status code: %i." % r.status_code)
+    return phases
+
+def summarize(results):
+    #merge results of all workers
+    hist = LatencyHistogram()
+    counters = Counter()
+    for result in results:
+        hist.merge(result[0])
+        counters.update(result[1])
+    return hist, counters
+
+def print_phase(title, hist, counters, walltime, unit='documents'):
+    #print summary of one test phase
+    print ("%s:\n"
+           "%s\n\n"
+           "Total number of %s: %i\n"
+           "Average time duration for one request:%.3fs\n"
+           "Latency: %s\n"
+           "Wall clock time:%.3fs\n"
+           "Aggregate throughput:%.1f %s/sec"
+           % (title, '-'*len(title), unit, hist.count, hist.average(), format_latency(hist),
+              walltime, (hist.count/walltime if walltime else 0), unit))
+    if 'documents' in counters:
+        print ("Aggregate throughput:%.1f documents/sec" % (counters['documents']/walltime if walltime else 0))
+    if args.slo:
+        p99 = hist.percentile(99)*1000
+        print ("p99 latency %.3fms %s SLO %.3fms" % (p99, ('is within' if p99 <= args.slo else 'exceeds'), args.slo))
+    for name in sorted(counters):
+        print ("Total number of %s: %i" % (name, counters[name]))
+    print ("")
+
+def phase_result(title, hist, counters, walltime, unit):
+    #machine readable result of one test phase
+    result = {'title': title, 'unit': unit, 'count': hist.count, 'walltime': walltime,
+              'throughput': (hist.count/walltime if walltime else 0),
+              'counters': dict(counters),
+              'latency': dict([('p%g' % p, hist.percentile(p)) for p in PERCENTILES] + [('average', hist.average()), ('max', hist.max)]),
+              'histogram': hist.to_dict(),
+              'throughput_series': hist.throughput_series()}
+    if 'documents' in counters:
+        result['documents_throughput'] = counters['documents']/walltime if walltime else 0
+    return result
+
+def write_results(filename, phases, version):
+    #write parameters and results of all test phases to JSON or CSV (by file extension) file
+    results = [phase_result(*phase) for phase in phases]
+    if filename.endswith('.csv'):
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['title', 'unit', 'count', 'walltime', 'throughput', 'documents_throughput', 'average'] +
+                            ['p%g' % p for p in PERCENTILES] + ['max', 'counters', 'throughput_series'])
+            for result in results:
+                writer.writerow([result['title'], result['unit'], result['count'], '%.6f' % result['walltime'],
+                                 '%.3f' % result['throughput'], '%.3f' % result.get('documents_throughput', 0),
+                                 '%.6f' % result['latency']['average']] +
+                                ['%.6f' % result['latency']['p%g' % p] for p in PERCENTILES] +
+                                ['%.6f' % result['latency']['max'],
+                                 ';'.join('%s=%i' % (name, value) for name, value in sorted(result['counters'].items())),
+                                 ' '.join(str(n) for n in result['throughput_series'])])
+    else:
+        parameters = dict(vars(args))
+        #never store credentials from instance URL
+        parameters['instance'] = (urllib.parse.urlparse(args.instance).netloc).rsplit('@',1)[-1]
+        with open(filename, 'w') as f:
+            json.dump({'time': datetime.datetime.now().isoformat(), 'couchdb_version': version,
+                       'parameters': parameters, 'phases': results}, f, indent=1)
+
+def welch_pvalue(a, b):
+    #two-sided p-value of Welch t-test with normal approximation of t distribution
+    if len(a) < 2 or len(b) < 2:
+        return 1.0
+    se = math.sqrt(statistics.variance(a)/len(a) + statistics.variance(b)/len(b))
+    diff = statistics.mean(b) - statistics.mean(a)
+    if se == 0:
+        return 0.0 if diff else 1.0
+    return math.erfc(abs(diff/se)/math.sqrt(2))
+
+def steady_series(series):
+    #throughput series without first and last partial seconds
+    return series[1:-1] if len(series) > 3 else series
+
+def change(old, new):
+    return "%+.1f%%" % ((new-old)*100.0/old) if old else "n/a"
+
+def compare():
+    #compare results of runs with first (baseline) file and flag significant changes
+    runs = []
+    for filename in args.files:
+        if not os.path.isfile(filename):
+            print("\nFile \"%s\" not found... Exiting...\n" % filename)
+            return
+        with open(filename) as f:
+            runs.append((filename, json.load(f)))
+    basename, base = runs[0]
+    for filename, run in runs[1:]:
+        print ("\nComparison of \"%s\" with baseline \"%s\":\n"
+               "========================================================\n" % (filename, basename))
+        for name in ('couchdb_version', 'parameters'):
+            if run.get(name) != base.get(name):
+                print ("Warning: %s differ from baseline\n" % name.replace('_', ' '))
+        phases = dict((phase['title'], phase) for phase in run['phases'])
+        for bphase in base['phases']:
+            phase = phases.get(bphase['title'])
+            if phase is None:
+                print ("%s: not found\n" % bphase['title'])
+                continue
+            print ("%s:\n%s\n" % (bphase['title'], '-'*len(bphase['title'])))
+            pvalue = welch_pvalue(steady_series(bphase['throughput_series']), steady_series(phase['throughput_series']))
+            print ("%s throughput: %.1f -> %.1f %s/sec (%s)%s" % ('*' if pvalue < args.alpha else ' ',
+                   bphase['throughput'], phase['throughput'], phase['unit'], change(bphase['throughput'], phase['throughput']),
+                   ' significant, p=%.4f' % pvalue if pvalue < args.alpha else ''))
+            bhist = LatencyHistogram.from_dict(bphase['histogram'])
+            hist = LatencyHistogram.from_dict(phase['histogram'])
+            for p in PERCENTILES[1:]:
+                #change is significant if confidence intervals of percentile do not overlap
+                blow, bhigh = bhist.percentile_interval(p)
+                low, high = hist.percentile_interval(p)
+                significant = low > bhigh or high < blow
+                print ("%s p%g latency: %.3fms -> %.3fms (%s)%s" % ('*' if significant else ' ', p,
+                       bhist.percentile(p)*1000, hist.percentile(p)*1000, change(bhist.percentile(p), hist.percentile(p)),
+                       ' significant' if significant else ''))
+            for name in sorted(set(bphase['counters']) | set(phase['counters'])):
+                if 'failed' in name or name in ('conflicts', 'missing documents'):
+                    print ("  %s: %i -> %i" % (name, bphase['counters'].get(name, 0), phase['counters'].get(name, 0)))
+            print ("")
 
 def main():
     try:
         # Ensure there are no paralell runs of this script
         lock.acquire(timeout=5)
 
-        # variables for calculating summary values
-        wtimesum = 0
-        wtimeaverage = 0
-        wdocsnum = 0
-        rtimesum = 0
-        rtimeaverage = 0
-        rdocsnum = 0
         #replication tasks server
         couch = couchdb.Server(args.instance)
         #replication documents database
@@ -61,64 +871,54 @@ def main():
             if args.dbname in couch:
                 print('Database with name %s already exists in instance!' % args.dbname)
             else:
+                db_url = '%s/%s' % (args.instance,urllib.parse.quote(args.dbname,safe=''))
 
                 if args.shardsnum:
-                    r = requests.put('%s/%s?q=%i'% (args.instance,urllib.parse.quote(args.dbname,safe=''),args.shardsnum))
+                    r = requests.put('%s?q=%i'% (db_url,args.shardsnum))
                 else:
-                    r = requests.put('%s/%s'% (args.instance,urllib.parse.quote(args.dbname,safe='')))
+                    r = requests.put(db_url)
 
                 if (r.status_code == 200) or (r.status_code == 201):
                     db = couch[args.dbname]
+                    session = make_session(args.concurrency)
 
                     #write perfomance test
-                    for docnum in range(args.docsnum):
-                        data = {}
-                        for fieldnum in range(args.fieldsnum):
-                            data['field%i' % fieldnum ] = gen_string(8,12)
-                        #calculating time need for writing document in instance
-                        if args.wq:
-                            ts = time.perf_counter()
-                            response = db.save(data,w=args.wq)
-                            tf = time.perf_counter()
-                        else:
-                            ts = time.perf_counter()
-                            response = db.save(data)
-                            tf = time.perf_counter()
-                        t = tf-ts
-                        #add spent time to summary if response contains list with two items (_id,_rev)
-                        if len(response) == 2:
-                            wtimesum += t
-                            wdocsnum += 1
-                    wtimeaverage = wtimesum/wdocsnum
-
-                    #read perfomance test
-                    for docid in db:
-                        #calculating time need for reading document from instance
-                        ts = time.perf_counter()
-                        doc = db.get(docid,r=args.rq)
-                        tf = time.perf_counter()
-                        t = tf-ts
-                        if len(doc) > 0:
-                            rtimesum += t
-                            rdocsnum += 1
-                    rtimeaverage = rtimesum/rdocsnum
-
-
-                    #read perfomance test
-                    print ("\nPerfomance test summary:\n"
-                           "========================================================\n\n"
-                           "Write perfomance:\n"
-                           "-----------------\n\n"
-                           "Total number of documents written: %i\n"
-                           "Total time duration for creating all documents:%.3fs\n"
-                           "Average time duration for creating one document:%.3fs\n\n"
-
-                           "Read perfomance:\n"
-                           "-----------------\n\n"
-                           "Total number of documents readed: %i\n"
-                           "Total time duration for reading all documents:%.3fs\n"
-                           "Average time duration for reading one document:%.3fs\n\n"
-                           % (wdocsnum,wtimesum,wtimeaverage,rdocsnum,rtimesum,rtimeaverage))
+                    #documents are generated by numbered blocks, every worker generates own blocks
+                    if args.batchsize:
+                        factory = PayloadFactory(args.docsnum, args.fieldsnum, args.batchsize, args.seed)
+                        results, wwalltime = run_workers(lambda batchnums, schedule: bulk_write_worker(session, db_url, factory, batchnums, schedule), range(factory.blocksnum()), args.concurrency)
+                        wunit = 'batches'
+                    else:
+                        factory = PayloadFactory(args.docsnum, args.fieldsnum, 1000, args.seed)
+                        results, wwalltime = run_workers(lambda blocknums, schedule: write_worker(session, db_url, factory, blocknums, schedule), range(factory.blocksnum()), args.concurrency)
+                        wunit = 'documents'
+                    whist, wcounters = summarize(results)
+
+                    phases = [("Write perfomance", whist, wcounters, wwalltime, wunit)]
+
+                    #read perfomance test in every selected mode on the same data
+                    docids = [docid for docid in db if not docid.startswith('_design/')]
+                    for mode in (args.readmodes or ['single']):
+                        rhist, rcounters, rwalltime, runit = read_test(session, db_url, docids, mode)
+                        phases.append(("Read perfomance (%s)" % mode, rhist, rcounters, rwalltime, runit))
+
+                    #mixed workload test on the same data
+                    if args.workload:
+                        phases.extend(workload_test(session, db, db_url))
+
+                    #view and mango index build and query tests
+                    if args.views:
+                        phases.extend(view_test(session, db_url))
+
+                    print ("\nPerfomance test summary (concurrency: %i, %s):\n"
+                           "========================================================\n"
+                           % (args.concurrency, ('open-loop rate: %g requests/sec' % args.rate if args.rate else 'closed-loop')))
+                    for phase in phases:
+                        print_phase(*phase)
+
+                    if args.resultfile:
+                        write_results(args.resultfile, phases, couch.version())
+                        print ("Results written to \"%s\"\n" % args.resultfile)
                 else:
                     print("Error creating database! Response status code: %i." % r.status_code)
         else:
@@ -164,11 +964,27 @@ if __name__ == '__main__':
     #Parser settings
     parser = argparse.ArgumentParser(
     usage = "\n\ncouchdb_benchmark.py [-I <instance URL>] [-D <database name>] [-N <number of documents>]\n\n"
+            "couchdb_benchmark.py compare <baseline result file> <result file> [<result file> ...]\n\n"
             "Optional arguments:\n\n" \
             "[--fieldsnum <number> ] Optional number of fields in each documents. Default: 10.\n\n" \
             "[--shardsnum <number> ] Optional number of shards for test database.\n\n" \
             "[--wq <number> ] Optional write quorum for documents.\n\n" \
-            "[--rq <number> ] Optional read quorum for documents.\n\n",
+            "[--rq <number> ] Optional read quorum for documents.\n\n" \
+            "[--concurrency <number> ] Optional number of parallel client threads. Default: 1.\n\n" \
+            "[--batch-size <number> ] Optional number of documents in one _bulk_docs request. Documents are written one by one if not set.\n\n" \
+            "[--rate <number> ] Optional open-loop mode: requests are sent on fixed timetable with this rate per second.\n\n" \
+            "[--slo <ms> ] Optional p99 latency SLO in milliseconds to check in summary.\n\n" \
+            "[--seed <number> ] Optional seed of documents generator to send byte-identical documents in repeated runs.\n\n" \
+            "[--workload <a|b|c|d|mixed|read=N,insert=N,update=N,delete=N> ] Optional mixed workload profile runned after read tests.\n\n" \
+            "[--distribution <uniform|zipfian|latest> ] Optional key distribution for workload. Default: from profile.\n\n" \
+            "[--operations <number> ] Optional number of workload operations. Default: number of documents.\n\n" \
+            "[--views ] Optional view and mango index build and query tests.\n\n" \
+            "[--design-file <filename> ] Optional JSON file with design document for view tests.\n\n" \
+            "[--queries <number> ] Optional number of queries in every view and mango query test. Default: 1000.\n\n" \
+            "[--mango-field <name> ] Optional document field for mango queries. Default: field1.\n\n" \
+            "[--result-file <filename> ] Optional file to write results in JSON (or CSV if file name ends with .csv) format.\n\n" \
+            "[--read-mode <single|all_docs|keys|bulk_get> ] Optional read test mode, can be set several times to compare modes. Default: single.\n\n" \
+            "[--page-size <number> ] Optional number of documents in one page for paged read modes. Default: 100.\n\n",
         description='Couchdb benchmark test')
 
     parser.add_argument(
@@ -235,7 +1051,181 @@ if __name__ == '__main__':
         help = "Optional number of fields in every document. Default: 10. ",
     )
 
+    parser.add_argument(
+        "--concurrency",
+        action = "store",
+        type = int,
+        dest = "concurrency",
+        required = False,
+        default = 1,
+        help = "Optional number of parallel client threads sharing one connection pool. Default: 1. ",
+    )
+
+    parser.add_argument(
+        "--batch-size",
+        action = "store",
+        type = int,
+        dest = "batchsize",
+        required = False,
+        help = "Optional number of documents in one _bulk_docs request. Documents are written one by one if not set.",
+    )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--rate",
+        action = "store",
+        type = float,
+        dest = "rate",
+        required = False,
+        help = "Optional open-loop mode: requests are sent on fixed timetable with this rate per second and latency is measured from intended send time. Concurrency must be enough to keep the rate.",
+    )
+
+    parser.add_argument(
+        "--slo",
+        action = "store",
+        type = float,
+        dest = "slo",
+        required = False,
+        help = "Optional p99 latency SLO in milliseconds, summary shows whether every test phase is within it.",
+    )
+
+    parser.add_argument(
+        "--seed",
+        action = "store",
+        type = int,
+        dest = "seed",
+        required = False,
+        help = "Optional seed of documents generator. Repeated runs with the same seed send byte-identical documents.",
+    )
+
+    parser.add_argument(
+        "--workload",
+        action = "store",
+        type = str,
+        dest = "workload",
+        required = False,
+        help = "Optional YCSB-like workload profile runned on written documents: a (50%% read, 50%% update), b (95%% read, 5%% update), c (read only), d (95%% read, 5%% insert, latest distribution), mixed (60%% read, 15%% insert, 15%% update, 10%% delete) or custom ratio like read=70,update=20,delete=10.",
+    )
+
+    parser.add_argument(
+        "--distribution",
+        action = "store",
+        type = str,
+        dest = "distribution",
+        required = False,
+        choices = ['uniform', 'zipfian', 'latest'],
+        help = "Optional key distribution for workload operations. Default: from workload profile.",
+    )
+
+    parser.add_argument(
+        "--operations",
+        action = "store",
+        type = int,
+        dest = "operations",
+        required = False,
+        help = "Optional number of workload operations. Default: number of documents.",
+    )
+
+    parser.add_argument(
+        "--read-mode",
+        action = "append",
+        type = str,
+        dest = "readmodes",
+        required = False,
+        choices = ['single', 'all_docs', 'keys', 'bulk_get'],
+        help = "Optional read test mode: single documents, paged _all_docs?include_docs=true, POST _all_docs with keys or _bulk_get. Can be set several times. Default: single.",
+    )
+
+    parser.add_argument(
+        "--page-size",
+        action = "store",
+        type = int,
+        dest = "pagesize",
+        required = False,
+        default = 100,
+        help = "Optional number of documents in one page for paged read modes. Default: 100.",
+    )
+
+    parser.add_argument(
+        "--views",
+        action='store_true',
+        dest = "views",
+        required = False,
+        help = "Optional parameter. Set if you need view and mango tests: design document index build time while writes continue, key, range, reduce and group view queries, mango _find queries with and without index.",
+    )
+
+    parser.add_argument(
+        "--design-file",
+        action = "store",
+        type = str,
+        dest = "designfile",
+        required = False,
+        help = "Optional JSON file with design document for view tests. Default: one view with [first char, field0] keys and _count reduce.",
+    )
+
+    parser.add_argument(
+        "--queries",
+        action = "store",
+        type = int,
+        dest = "queries",
+        required = False,
+        default = 1000,
+        help = "Optional number of queries in every view and mango query test. Default: 1000.",
+    )
+
+    parser.add_argument(
+        "--mango-field",
+        action = "store",
+        type = str,
+        dest = "mangofield",
+        required = False,
+        default = "field1",
+        help = "Optional document field for mango _find queries and index. Default: field1.",
+    )
+
+    parser.add_argument(
+        "--result-file",
+        action = "store",
+        type = str,
+        dest = "resultfile",
+        required = False,
+        help = "Optional file to write parameters, throughput, latency histograms, counters and per second throughput in JSON format (or CSV summary if file name ends with .csv).",
+    )
+
+    #Compare subcommand parser settings
+    compare_parser = argparse.ArgumentParser(
+    usage = "\n\ncouchdb_benchmark.py compare <baseline result file> <result file> [<result file> ...]\n\n"
+            "Optional arguments:\n\n" \
+            "[--alpha <number> ] Optional significance level for throughput changes. Default: 0.05.\n\n",
+        description='Couchdb benchmark results compare')
+
+    compare_parser.add_argument(
+        "files",
+        nargs = "+",
+        type = str,
+        help = "JSON result files, first one is a baseline",
+    )
+
+    compare_parser.add_argument(
+        "--alpha",
+        action = "store",
+        type = float,
+        dest = "alpha",
+        required = False,
+        default = 0.05,
+        help = "Optional significance level for throughput changes. Default: 0.05.",
+    )
 
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        args = compare_parser.parse_args(sys.argv[2:])
+        if len(args.files) < 2:
+            compare_parser.error("at least two result files are required")
+        compare()
+    else:
+        args = parser.parse_args()
+        #workload is checked before test, so wrong profile does not waste write and read phases
+        if args.workload:
+            try:
+                parse_workload(args.workload)
+            except ValueError as e:
+                parser.error(str(e))
+        main()
@@ -0,0 +1,295 @@
+#!/usr/bin/python3
+# This script compact fragmented databases of couchdb instance.
+
+'''
+    Couchdb database compaction script.
+    Compact databases of couchdb instance with fragmentation above threshold.
+
+    Author: Egor Pavlov
+    e-mail: xpm.pub@gmail.com'''
+
+
+import logging
+import getpass
+import argparse
+import urllib
+import time
+import couchdb
+from lockfile import FileLock, LockTimeout, AlreadyLocked
+from logging import handlers
+from urllib.parse import urlparse
+from couchdb_db_sizes import iter_db_info, fragmentation
+
+#This is a filter which injects contextual information into the log.
+class ContextFilter(logging.Filter):
+
+    def filter(self, record):
+        #get user which run this scripts
+        record.user = getpass.getuser()
+        return True
+
+#types of compaction tasks in _active_tasks
+COMPACTION_TASKS = ('database_compaction', 'view_compaction')
+
+def select_candidates(couch):
+    #databases not less than --min-size with fragmentation not less than --min-fragmentation
+    #sorted by size reclaimable by compaction, largest first
+    candidates = []
+    for dbname, info in iter_db_info(args.instance, couch, args.batch_size, args.parallel):
+        file_size = info["sizes"]["file"]
+        active_size = info["sizes"]["active"]
+        ratio = fragmentation(file_size, active_size)
+        if file_size/1024/1024 >= args.minsize and ratio*100 >= args.min_fragmentation:
+            candidates.append((file_size - active_size, dbname, file_size, ratio))
+    candidates.sort(reverse=True)
+    return candidates
+
+def task_database(task):
+    #database name of task, clustered instances show shard file like shards/00000000-1fffffff/dbname.1600000000
+    name = task.get('database', '')
+    if name.startswith('shards/'):
+        name = name.split('/', 2)[2].rsplit('.', 1)[0]
+    return name
+
+def probe_latency(couch, dbname):
+    #median time in seconds of three database info requests, info is read from database shard files
+    times = []
+    for i in range(3):
+        ts = time.perf_counter()
+        couch.resource(dbname).get_json()
+        times.append(time.perf_counter() - ts)
+    return sorted(times)[1]
+
+def start_compaction(couch, dbname):
+    #start compaction of database and with --views compaction of every view group and cleanup of old index files
+    db = couch[dbname]
+    db.compact()
+    if args.views:
+        for row in db.view('_all_docs', startkey='_design/', endkey='_design0'):
+            db.compact(row.id[len('_design/'):])
+        db.cleanup()
+
+def main():
+    try:
+        # Ensure there are no paralell runs of this script
+        lock.acquire(timeout=5)
+
+        #instance
+        instance = (urlparse(args.instance).netloc).rsplit('@',1)[-1]
+        couch = couchdb.Server(args.instance)
+
+        print("\nCollecting sizes of databases of instance \"%s\"...\n" % instance)
+        candidates = select_candidates(couch)
+        print("%i databases not less than %i Mb with fragmentation not less than %.1f%% will be compacted:\n" % (len(candidates),args.minsize,args.min_fragmentation))
+        for reclaimable, dbname, file_size, ratio in candidates:
+            print("Name: %s | Size: %i Mb | Fragmentation: %.1f%% | Reclaimable: %i Mb" % (urllib.parse.quote(dbname,safe=''), file_size/1024/1024, ratio*100, reclaimable/1024/1024))
+        if args.dry_run or not candidates:
+            return
+
+        #latency limit is relative to latency before compaction if not set
+        baseline = probe_latency(couch, candidates[0][1])
+        max_latency = (args.max_latency / 1000.0) if args.max_latency else baseline * 3
+        print("\nLatency baseline: %.1fms, latency limit: %.1fms\n" % (baseline*1000, max_latency*1000))
+
+        #compactions are started while less than --concurrency are running and latency is below limit
+        #above limit one compaction is still running, so high latency does not stop compaction at all
+        queue = list(candidates)
+        active = {}
+        c_count = 0
+        f_count = 0
+        reclaimed = 0
+        latency = baseline
+        ts = time.time()
+        while queue or active:
+            #above latency limit only one compaction is running
+            limit = args.concurrency
+            if latency > max_latency:
+                limit = 1
+                if active:
+                    print("Latency %.1fms is above limit, new compactions are paused..." % (latency*1000))
+            while queue and len(active) < limit:
+                reclaimable, dbname, file_size, ratio = queue.pop(0)
+                try:
+                    start_compaction(couch, dbname)
+                except Exception as e:
+                    f_count += 1
+                    logger.info('Error: compaction of database %s not started: %s' % (dbname,e))
+                    print("Error: compaction of database \"%s\" not started: %s" % (dbname,e))
+                    continue
+                active[dbname] = (file_size, time.time())
+                print("Compaction of database \"%s\" started..." % dbname)
+            time.sleep(args.interval)
+
+            #progress of compaction tasks by database
+            status, headers, tasks = couch.resource.get_json('_active_tasks')
+            progress = {}
+            for task in tasks:
+                if task.get('type') in COMPACTION_TASKS and task_database(task) in active:
+                    progress.setdefault(task_database(task), []).append(task.get('progress', 0))
+
+            #database is compacted when compact_running flag is cleared and no compaction tasks left
+            for dbname in list(active):
+                status, headers, info = couch.resource(dbname).get_json()
+                if info.get('compact_running') or dbname in progress:
+                    continue
+                file_size, started = active.pop(dbname)
+                c_count += 1
+                reclaimed += file_size - info["sizes"]["file"]
+                print("%i/%i: Database \"%s\" compacted in %.1fs, %i Mb reclaimed (%i Mb -> %i Mb)." % (c_count,len(candidates),dbname,time.time()-started,(file_size - info["sizes"]["file"])/1024/1024,file_size/1024/1024,info["sizes"]["file"]/1024/1024))
+
+            latency = probe_latency(couch, next(iter(active)) if active else (queue[0][1] if queue else candidates[0][1]))
+            print("Running: %s | Queued: %i | Latency: %.1fms" % (', '.join('%s %i%%' % (dbname, sum(progress[dbname])/len(progress[dbname])) for dbname in active if dbname in progress) or len(active),len(queue),latency*1000))
+
+        duration = time.time() - ts
+        print("\n%i databases compacted in %.1fs, %i Mb reclaimed." % (c_count,duration,reclaimed/1024/1024))
+        if f_count:
+            print("%i databases failed." % f_count)
+
+    except LockTimeout:
+        logger.info('Lock not acquired, exiting')
+    except AlreadyLocked:
+        logger.info('Already locked, exiting')
+    except Exception as e:
+        logger.info(type(e))
+        logger.info('Error: %s' % e)
+    finally:
+
+        # Release the lock
+        if lock.i_am_locking():
+            lock.release()
+
+if __name__ == '__main__':
+
+    # The script must not be executed simultaneously
+    lock = FileLock("/tmp/couchdb_db_compact")
+
+    #create filter
+    f = ContextFilter()
+
+    #Logger settings
+    logger = logging.getLogger()
+    logger.name = 'CouchdbCompact'
+    logger.setLevel(logging.INFO)
+
+    # add handler to the logger
+    handler = logging.handlers.SysLogHandler(address='/dev/log')
+
+    # add formatter to the handler
+    formatter = logging.Formatter('%(name)s[%(process)d]: (%(user)s) %(levelname)s %(message)s')
+
+    handler.formatter = formatter
+    logger.addHandler(handler)
+    logger.addFilter(f)
+
+    #Parser settings
+    parser = argparse.ArgumentParser(
+    usage = "\n\ncouchdb_db_compact.py [-I <instance URL>]\n\n"
+            "Optional arguments:\n\n" \
+            "--min-size <int> Minimal database size to compact in Mb. Default: 100 Mb\n\n" \
+            "--min-fragmentation <float> Minimal share of database file not used by live data in percents. Default: 50\n\n" \
+            "--views Compact views of databases too\n\n" \
+            "--concurrency <int> Number of databases compacted at once. Default: 2\n\n" \
+            "--max-latency <ms> Latency of database info request above which new compactions are paused. Default: three times of latency before start\n\n" \
+            "--interval <seconds> Poll interval of _active_tasks. Default: 10\n\n" \
+            "--batch-size <int> Number of databases in one _dbs_info request. Default: 100\n\n" \
+            "--parallel <int> Number of parallel info requests on instances without _dbs_info. Default: 8\n\n" \
+            "--dry-run Show databases selected for compaction and exit\n\n",
+        description='Couchdb database compaction script')
+
+    parser.add_argument(
+        "-I",
+        action = "store",
+        type = str,
+        dest = "instance",
+        required = True,
+        help = "Instance with port URL and auth credentials"
+    )
+
+    parser.add_argument(
+        "--min-size",
+        action = "store",
+        type = int,
+        dest = "minsize",
+        required = False,
+        default = int(100),
+        help = "Minimal size of database in Mb to compact. Default: 100 Mb"
+    )
+
+    parser.add_argument(
+        "--min-fragmentation",
+        action = "store",
+        type = float,
+        dest = "min_fragmentation",
+        required = False,
+        default = float(50),
+        help = "Minimal fragmentation of database in percents, (file - active) / file size. Default: 50"
+    )
+
+    parser.add_argument(
+        "--views",
+        action = "store_true",
+        dest = "views",
+        required = False,
+        help = "Compact every view group of database and remove old index files after database compaction is started"
+    )
+
+    parser.add_argument(
+        "--concurrency",
+        action = "store",
+        type = int,
+        dest = "concurrency",
+        required = False,
+        default = int(2),
+        help = "Number of databases compacted at once. Default: 2"
+    )
+
+    parser.add_argument(
+        "--max-latency",
+        action = "store",
+        type = float,
+        dest = "max_latency",
+        required = False,
+        help = "Latency of database info request in milliseconds above which new compactions are not started. Default: three times of latency before start"
+    )
+
+    parser.add_argument(
+        "--interval",
+        action = "store",
+        type = int,
+        dest = "interval",
+        required = False,
+        default = int(10),
+        help = "Poll interval of _active_tasks in seconds. Default: 10"
+    )
+
+    parser.add_argument(
+        "--batch-size",
+        action = "store",
+        type = int,
+        dest = "batch_size",
+        required = False,
+        default = int(100),
+        help = "Number of databases in one _dbs_info request, must not exceed max_db_number_for_dbs_info_req of instance. Default: 100"
+    )
+
+    parser.add_argument(
+        "--parallel",
+        action = "store",
+        type = int,
+        dest = "parallel",
+        required = False,
+        default = int(8),
+        help = "Number of parallel database info requests on instances without _dbs_info. Default: 8"
+    )
+
+    parser.add_argument(
+        "--dry-run",
+        action = "store_true",
+        dest = "dry_run",
+        required = False,
+        help = "Show databases selected for compaction and exit"
+    )
+
+    args = parser.parse_args()
+
+    main()
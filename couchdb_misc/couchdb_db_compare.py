@@ -17,6 +17,9 @@ import argparse
 import re
 import urllib
 import couchdb
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from lockfile import FileLock, LockTimeout, AlreadyLocked
 from logging import handlers
 from urllib.parse import urlparse
@@ -29,6 +32,166 @@ class ContextFilter(logging.Filter):
         record.user = getpass.getuser()
         return True
 
+def iter_all_dbs(couch):
+    #stream database names of instance sorted by name, _all_dbs is requested by pages of --page-size names
+    #one extra name is requested as startkey of next page, so deleted databases do not shift pages
+    startkey = None
+    while True:
+        params = {'limit': args.page_size + 1}
+        if startkey is not None:
+            params['startkey'] = json.dumps(startkey)
+        status, headers, data = couch.resource.get_json('_all_dbs', **params)
+        #instances without _all_dbs paging (couchdb 1.x) return all databases at once
+        if len(data) > args.page_size + 1 or (startkey is not None and data and data[0] < startkey):
+            for db_name in data:
+                if startkey is None or db_name >= startkey:
+                    yield db_name
+            return
+        for db_name in data[:args.page_size]:
+            yield db_name
+        if len(data) <= args.page_size:
+            return
+        startkey = data[-1]
+
+def iter_sorted(names, host):
+    #check that names are sorted, merge compare is not possible otherwise
+    previous = None
+    for name in names:
+        if previous is not None and name <= previous:
+            raise Exception('databases of "%s" are not sorted by name: "%s" after "%s"' % (host, name, previous))
+        previous = name
+        yield name
+
+def merge_sorted(s_items, t_items):
+    #merge of two streams of (key, value) pairs sorted by key, yields key, source value and target value
+    #value is None for key which is missing in one of streams
+    s_item = next(s_items, None)
+    t_item = next(t_items, None)
+    while s_item is not None or t_item is not None:
+        if t_item is None or (s_item is not None and s_item[0] < t_item[0]):
+            yield s_item[0], s_item[1], None
+            s_item = next(s_items, None)
+        elif s_item is None or t_item[0] < s_item[0]:
+            yield t_item[0], None, t_item[1]
+            t_item = next(t_items, None)
+        else:
+            yield s_item[0], s_item[1], t_item[1]
+            s_item = next(s_items, None)
+            t_item = next(t_items, None)
+
+#couchdb servers of current thread, response cache of couchdb.Server is not thread safe
+thread_data = threading.local()
+
+def thread_server(url):
+    if not hasattr(thread_data, 'servers'):
+        thread_data.servers = {}
+    if url not in thread_data.servers:
+        thread_data.servers[url] = couchdb.Server(url)
+    return thread_data.servers[url]
+
+def iter_all_docs(couch, db_name):
+    #stream ids and revisions of documents sorted by id, _all_docs is requested by pages of --page-size rows
+    resource = couch.resource(db_name, '_all_docs')
+    startkey = None
+    while True:
+        params = {'limit': args.page_size + 1}
+        if startkey is not None:
+            params['startkey'] = json.dumps(startkey)
+        status, headers, data = resource.get_json(**params)
+        rows = data['rows']
+        for row in rows[:args.page_size]:
+            yield row['id'], row['value']['rev']
+        if len(rows) <= args.page_size:
+            return
+        startkey = rows[-1]['id']
+
+def compare_database(db_name, report):
+    #compare database on both instances by doc_count and doc_del_count first, with --full-compare always by documents
+    #on mismatch documents of both instances are streamed and merge compared by id and revision,
+    #every difference is passed to report(db_name, missing|extra|divergent, id, source rev, target rev) when found
+    #returns source and target info and Counter of differences or None for match by document counts
+    s_couch = thread_server(args.s_instance)
+    t_couch = thread_server(args.t_instance)
+    status, headers, s_info = s_couch.resource(db_name).get_json()
+    status, headers, t_info = t_couch.resource(db_name).get_json()
+    if not args.full_compare and (s_info['doc_count'], s_info['doc_del_count']) == (t_info['doc_count'], t_info['doc_del_count']):
+        return s_info, t_info, None
+    counts = Counter()
+    for doc_id, s_rev, t_rev in merge_sorted(iter_all_docs(s_couch, db_name), iter_all_docs(t_couch, db_name)):
+        if t_rev is None:
+            kind = 'missing'
+        elif s_rev is None:
+            kind = 'extra'
+        elif s_rev != t_rev:
+            kind = 'divergent'
+        else:
+            continue
+        counts[kind] += 1
+        report(db_name, kind, doc_id, s_rev, t_rev)
+    return s_info, t_info, counts
+
+class ResultFile(object):
+    #Result file with quoted database names, created on first written name.
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = None
+
+    def write(self, db_name):
+        if self.f is None:
+            self.f = open(self.filename, "w")
+        self.f.write(db_name + '\n')
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+
+def deep_compare(databases, source, target):
+    #compare content of databases existing on both instances by --parallel threads and show differences
+    print("\nComparing content of %i databases existing on \"%s\" and \"%s\" ...\n" % (len(databases),source,target))
+    if args.res_files:
+        d = ResultFile("%s-%s.diff" % (source,target))
+    #differences are written by compare threads while found, output is serialized by lock
+    output_lock = threading.Lock()
+
+    def report(db_name, kind, doc_id, s_rev, t_rev):
+        db_name = urllib.parse.quote(db_name,safe='')
+        with output_lock:
+            print("Database \"%s\" %s: %s (%s)" % (db_name, kind, doc_id, ' / '.join(rev or '-' for rev in (s_rev, t_rev))))
+            if args.res_files:
+                d.write('\t'.join((db_name, kind, doc_id, s_rev or '-', t_rev or '-')))
+
+    m_count = 0
+    f_count = 0
+    mismatched = 0
+    totals = Counter()
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        futures = dict((executor.submit(compare_database, db_name, report), db_name) for db_name in databases)
+        for future in as_completed(futures):
+            db_name = urllib.parse.quote(futures[future],safe='')
+            try:
+                s_info, t_info, counts = future.result()
+            except Exception as e:
+                f_count += 1
+                logger.info('Error: compare of database %s failed: %s' % (db_name,e))
+                print("Error: compare of database \"%s\" failed: %s" % (db_name,e))
+                continue
+            if counts is None:
+                m_count += 1
+                continue
+            totals.update(counts)
+            if counts:
+                mismatched += 1
+            with output_lock:
+                print("Database \"%s\": %i/%i documents, %i/%i deleted, %i missing, %i extra, %i divergent" % (db_name,s_info['doc_count'],t_info['doc_count'],s_info['doc_del_count'],t_info['doc_del_count'],counts['missing'],counts['extra'],counts['divergent']))
+
+    print("\n%i databases match by document counts, %i databases compared by documents, %i databases have different documents ..." % (m_count,len(databases)-m_count-f_count,mismatched))
+    print("%i documents from \"%s\" missing on \"%s\", %i extra documents on \"%s\", %i documents with different revisions ...\n" % (totals['missing'],source,target,totals['extra'],target,totals['divergent']))
+    if f_count:
+        print("%i databases failed.\n" % f_count)
+    if args.res_files:
+        d.close()
 
 def main():
     try:
@@ -37,6 +200,8 @@ def main():
         #lists of databases
         s_databases = []
         t_databases = []
+        #databases on both instances for deep compare
+        databases = []
         #created replication tasks counters
         s_count=0
         t_count=0
@@ -48,36 +213,40 @@ def main():
         target = (urllib.parse.urlparse(args.t_instance).netloc).rsplit('@',1)[1]
         t_couch = couchdb.Server(args.t_instance)
 
-        print("\nCheck databases from \"%s\" which not exist on \"%s\" ...\nCreating list....\n" % (source,target))
-
-        for db_name in s_couch:
-            if ( not re.match(r'_', db_name) and db_name not in t_couch ):
-                s_databases.append(urllib.parse.quote(db_name,safe=''))
-
-        print("\nCheck databases from \"%s\" which not exist on \"%s\" ...\nCreating list....\n" % (target,source))
-
-        for db_name in t_couch:
-            if ( not re.match(r'_', db_name) and db_name not in s_couch ):
-                t_databases.append(urllib.parse.quote(db_name,safe=''))
+        print("\nCheck databases from \"%s\" which not exist on \"%s\" and from \"%s\" which not exist on \"%s\" ...\nCreating lists....\n" % (source,target,target,source))
 
+        #both instances are listed once and compared by sorted merge, only differences are kept
+        #result files are written while instances are listed
         if args.res_files:
-            if (len(s_databases) > 0):
-                s = open("%s.lst" % source, "w")
-            if (len(t_databases) > 0):
-                t = open("%s.lst" % target, "w")
+            s = ResultFile("%s.lst" % source)
+            t = ResultFile("%s.lst" % target)
+        s_names = iter_sorted(iter_all_dbs(s_couch), source)
+        t_names = iter_sorted(iter_all_dbs(t_couch), target)
+        for db_name, in_source, in_target in merge_sorted(((name, True) for name in s_names), ((name, True) for name in t_names)):
+            if re.match(r'_', db_name):
+                continue
+            if in_source and in_target:
+                if args.deep:
+                    databases.append(db_name)
+                continue
+            db_name = urllib.parse.quote(db_name,safe='')
+            if in_source:
+                s_databases.append(db_name)
+                if args.res_files:
+                    s.write(db_name)
+            else:
+                t_databases.append(db_name)
+                if args.res_files:
+                    t.write(db_name)
 
         if (len(s_databases) > 0):
             print("\nFollowing databases from \"%s\" not exist on \"%s\" ...\n" % (source,target))
             for db_name in s_databases:
-                if args.res_files:
-                    s.write(db_name + '\n')
                 print(db_name)
 
         if (len(t_databases) > 0):
             print("\nFollowing databases from \"%s\" not exist on \"%s\" ...\n" % (target,source))
             for db_name in t_databases:
-                if args.res_files:
-                    t.write(db_name + '\n')
                 print(db_name)
 
         print("\n%i databases from \"%s\" not exist on \"%s\" ...\n" % (len(s_databases),source,target))
@@ -85,10 +254,11 @@ def main():
 
         if args.res_files:
             print("\nWriting result files finished ...\n")
-            if (len(s_databases) > 0):
-                s.close()
-            if (len(t_databases) > 0):
-                t.close()
+            s.close()
+            t.close()
+
+        if args.deep:
+            deep_compare(databases, source, target)
 
         #logger.info()
 
@@ -132,7 +302,11 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
     usage = "\n\ncouchdb_db_compare.py [-S <instance URL> (Source instance)] [-T <instance URL> (Target instance)]\n\n"
             "Optional arguments:\n\n" \
-            "[--result-to-files ] Optional parameter. Set if you need additionaly have output files.\n\n",
+            "[--result-to-files ] Optional parameter. Set if you need additionaly have output files.\n\n" \
+            "[--page-size <count> ] Optional number of database names in one _all_dbs request and documents in one _all_docs request. Default: 10000.\n\n" \
+            "[--deep ] Optional parameter. Compare content of databases existing on both instances.\n\n" \
+            "[--full-compare ] Optional parameter. Compare documents of every database in deep mode, also when document counts match.\n\n" \
+            "[--parallel <count> ] Optional number of databases compared at once in deep mode. Default: 4.\n\n",
         description='Couchdb databases compare script')
 
     parser.add_argument(
@@ -161,6 +335,42 @@ if __name__ == '__main__':
         help = "Optional parameter. Set if you need additionaly have output files.",
     )
 
+    parser.add_argument(
+        "--page-size",
+        action = "store",
+        type = int,
+        dest = "page_size",
+        required = False,
+        default = 10000,
+        help = "Optional number of database names in one _all_dbs request and documents in one _all_docs request. Default: 10000. ",
+    )
+
+    parser.add_argument(
+        "--deep",
+        action='store_true',
+        dest = "deep",
+        required = False,
+        help = "Optional parameter. Compare databases existing on both instances by doc_count and doc_del_count, and on mismatch compare ids and revisions of all documents by sorted _all_docs streams. Missing, extra and divergent documents are shown and written to <source>-<target>.diff with --result-to-files.",
+    )
+
+    parser.add_argument(
+        "--full-compare",
+        action='store_true',
+        dest = "full_compare",
+        required = False,
+        help = "Optional parameter. Compare ids and revisions of documents of every database in deep mode, also when doc_count and doc_del_count match. Finds updates which did not reach target instance.",
+    )
+
+    parser.add_argument(
+        "--parallel",
+        action = "store",
+        type = int,
+        dest = "parallel",
+        required = False,
+        default = 4,
+        help = "Optional number of databases compared at once in deep mode. Default: 4. ",
+    )
+
     args = parser.parse_args()
 
     main()
@@ -17,6 +17,13 @@ import re
 import urllib
 import couchdb
 import operator
+import heapq
+import threading
+import time
+import sqlite3
+from itertools import chain, groupby, islice
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from lockfile import FileLock, LockTimeout, AlreadyLocked
 from logging import handlers
 from urllib.parse import urlparse
@@ -29,24 +36,217 @@ class ContextFilter(logging.Filter):
         record.user = getpass.getuser()
         return True
 
+#couchdb servers of current thread, response cache of couchdb.Server is not thread safe
+thread_data = threading.local()
+
+def thread_server(url):
+    if not hasattr(thread_data, 'servers'):
+        thread_data.servers = {}
+    if url not in thread_data.servers:
+        thread_data.servers[url] = couchdb.Server(url)
+    return thread_data.servers[url]
+
+def db_info(url, dbname):
+    #info of one database by single GET request, None if database was deleted after listing
+    try:
+        status, headers, info = thread_server(url).resource(dbname).get_json()
+        return info
+    except couchdb.http.ResourceNotFound:
+        return None
+
+def iter_db_info(url, dbnames, batch_size, parallel):
+    #yields database name and info by _dbs_info requests of batch_size databases (couchdb 2.2+)
+    #on older instances info of every database is requested by parallel threads
+    #also used by couchdb_db_compact.py
+    couch = thread_server(url)
+    dbnames = iter(dbnames)
+    while True:
+        batch = list(islice(dbnames, batch_size))
+        if not batch:
+            return
+        try:
+            status, headers, data = couch.resource.post_json('_dbs_info', body={'keys': batch})
+        except (couchdb.http.ResourceNotFound, couchdb.http.ServerError):
+            break
+        for row in data:
+            if row.get('info'):
+                yield row['key'], row['info']
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        remaining = list(chain(batch, dbnames))
+        for dbname, info in zip(remaining, executor.map(lambda dbname: db_info(url, dbname), remaining)):
+            if info:
+                yield dbname, info
+
+
+def open_history(filename):
+    #sqlite file with one row per database in every snapshot
+    history = sqlite3.connect(filename)
+    history.execute('CREATE TABLE IF NOT EXISTS sizes (time REAL, instance TEXT, db TEXT, file INTEGER, active INTEGER, external INTEGER, docs INTEGER)')
+    history.execute('CREATE INDEX IF NOT EXISTS sizes_db ON sizes (instance, db, time)')
+    return history
+
+def fragmentation(file_size, active_size):
+    #share of database file which is not used by live data and can be reclaimed by compaction
+    return (file_size - active_size) / file_size if file_size else 0.0
+
+def growth_rate(points):
+    #least squares slope of file size by time in bytes per day, points are (time, size) pairs
+    if len(points) < 2:
+        return 0.0
+    t0 = points[0][0]
+    days = [(t - t0) / 86400 for t, size in points]
+    mean_days = sum(days) / len(days)
+    mean_size = sum(size for t, size in points) / len(points)
+    var = sum((d - mean_days) ** 2 for d in days)
+    if not var:
+        return 0.0
+    return sum((d - mean_days) * (size - mean_size) for d, (t, size) in zip(days, points)) / var
+
+def report(history, instance):
+    #rank databases of instance from history by bytes reclaimable by compaction in last snapshot
+    #growth rate is calculated from all snapshots of database, projected size is after --days days
+    databases = []
+    rows = history.execute('SELECT db, time, file, active, external FROM sizes WHERE instance = ? ORDER BY db, time', (instance,))
+    for dbname, snapshots in groupby(rows, key=operator.itemgetter(0)):
+        snapshots = list(snapshots)
+        dbname, ts, file_size, active_size, external_size = snapshots[-1]
+        if file_size/1024/1024 < args.minsize:
+            continue
+        rate = growth_rate([(row[1], row[2]) for row in snapshots])
+        item = (file_size - active_size, dbname, file_size, active_size, external_size, rate, len(snapshots))
+        if args.top and len(databases) >= args.top:
+            heapq.heappushpop(databases, item)
+        else:
+            heapq.heappush(databases, item)
+
+    print("Compaction candidates of %s by reclaimable size:\n" % instance)
+    for reclaimable, dbname, file_size, active_size, external_size, rate, count in sorted(databases, reverse=True):
+        print("Name: %s | Size: %i Mb | Active: %i Mb | External: %i Mb | Fragmentation: %.1f%% | Reclaimable: %i Mb | Growth: %.1f Mb/day | Projected in %i days: %i Mb | Snapshots: %i" % (
+            urllib.parse.quote(dbname,safe=''), file_size/1024/1024, active_size/1024/1024, external_size/1024/1024, fragmentation(file_size, active_size)*100,
+            reclaimable/1024/1024, rate/1024/1024, args.days, max(0, file_size + rate*args.days)/1024/1024, count))
+
+def node_url(node):
+    #node-local requests through clustered port: /_node/<node>/...
+    return '%s/_node/%s' % (args.instance.rstrip('/'), node)
+
+def parse_shard(name):
+    #range and database name of shard file name like shards/00000000-1fffffff/dbname.1600000000
+    prefix, shard_range, name = name.split('/', 2)
+    return shard_range, name.rsplit('.', 1)[0]
+
+def shard_maps(dbnames):
+    #_shards maps of databases requested by --parallel threads, dict database: {range: [nodes]}
+    def shard_map(dbname):
+        status, headers, data = thread_server(args.instance).resource(dbname, '_shards').get_json()
+        return data['shards']
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        return dict(zip(dbnames, executor.map(shard_map, dbnames)))
+
+def shard_sizes(maps):
+    #file sizes of shard replicas of databases on every node from shard maps
+    #shard files are listed by one node-local _all_dbs request per node, shard info is requested by --parallel threads
+    #returns dict database: {(range, node): size}
+    nodes = sorted(set(node for shards in maps.values() for replicas in shards.values() for node in replicas))
+    shards = []
+    for node in nodes:
+        status, headers, names = thread_server(node_url(node)).resource.get_json('_all_dbs')
+        for name in names:
+            if name.startswith('shards/'):
+                shard_range, dbname = parse_shard(name)
+                if dbname in maps and node in maps[dbname].get(shard_range, []):
+                    shards.append((dbname, shard_range, node, name))
+    sizes = dict((dbname, {}) for dbname in maps)
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        for (dbname, shard_range, node, name), info in zip(shards, executor.map(lambda shard: db_info(node_url(shard[2]), shard[3]), shards)):
+            if info:
+                sizes[dbname][(shard_range, node)] = info["sizes"]["file"]
+    return sizes
+
+def skew(values):
+    #ratio of largest value to mean value, 1.0 is even distribution
+    values = list(values)
+    mean = sum(values) / len(values) if values else 0
+    return max(values) / mean if mean else 1.0
+
+def shard_report(dbnames):
+    #shard ranges and replicas of databases with sizes, totals by node
+    #databases with uneven ranges or shards larger than --max-shard-size are flagged
+    maps = shard_maps(dbnames)
+    sizes = shard_sizes(maps)
+    node_sizes = Counter()
+    node_shards = Counter()
+    for dbname in dbnames:
+        shards = maps[dbname]
+        #size of range is size of its largest replica
+        ranges = dict((shard_range, max([sizes[dbname].get((shard_range, node), 0) for node in replicas] or [0])) for shard_range, replicas in shards.items())
+        flags = []
+        range_skew = skew(ranges.values())
+        if range_skew >= args.skew:
+            flags.append('SKEWED RANGES')
+        if ranges and max(ranges.values())/1024/1024 > args.max_shard_size:
+            flags.append('RESHARD WITH HIGHER Q')
+        missing = [(shard_range, node) for shard_range, replicas in shards.items() for node in replicas if (shard_range, node) not in sizes[dbname]]
+        if missing:
+            flags.append('%i REPLICAS NOT FOUND' % len(missing))
+        print("Name: %s | Size: %i Mb | Q: %i | N: %i | Range skew: %.2f%s" % (urllib.parse.quote(dbname,safe=''), sum(sizes[dbname].values())/1024/1024, len(shards), max([len(replicas) for replicas in shards.values()] or [0]), range_skew, ''.join(' | %s' % flag for flag in flags)))
+        if flags:
+            for shard_range in sorted(shards):
+                print("    Range: %s | %s" % (shard_range, ', '.join('%s: %s' % (node, ('%i Mb' % (sizes[dbname][(shard_range, node)]/1024/1024) if (shard_range, node) in sizes[dbname] else 'not found')) for node in shards[shard_range])))
+        for (shard_range, node), size in sizes[dbname].items():
+            node_sizes[node] += size
+            node_shards[node] += 1
+
+    print("\nTotals by node:\n")
+    for node in sorted(node_sizes):
+        print("Node: %s | Shards: %i | Size: %i Mb" % (node, node_shards[node], node_sizes[node]/1024/1024))
+    node_skew = skew(node_sizes.values())
+    print("\nNode skew: %.2f%s" % (node_skew, (' | SKEWED NODES' if node_skew >= args.skew else '')))
 
 def main():
     try:
         # Ensure there are no paralell runs of this script
         lock.acquire(timeout=5)
-        #dict of databases names and source instances
-        databases = {}
+        instance = (urlparse(args.instance).netloc).rsplit('@',1)[-1]
+        history = open_history(args.history) if args.history else None
+
+        #ranking from history file only, instance is not scanned
+        if args.report:
+            if not history:
+                print("\nHistory file must be set with --history for report... Exiting...\n")
+                return
+            report(history, instance)
+            return
 
-        #get all unique database names from all instances and append them to dict
+        #heap of database sizes and names, only databases not less than --min-size are kept
+        #with --top only the largest databases are kept
+        databases = []
+
+        #get file sizes of all databases from instance, all databases are saved to history snapshot
         couch = couchdb.Server(args.instance)
-        for dbname in couch:
-            size=int((couch[dbname].info())["sizes"]["file"])/1024/1024
+        ts = time.time()
+        for dbname, info in iter_db_info(args.instance, couch, args.batch_size, args.parallel):
+            sizes = info["sizes"]
+            if history:
+                history.execute('INSERT INTO sizes VALUES (?, ?, ?, ?, ?, ?, ?)', (ts, instance, dbname, sizes["file"], sizes["active"], sizes["external"], info["doc_count"]))
+            size=int(sizes["file"])/1024/1024
             if (size >= args.minsize):
-                databases.update({urllib.parse.quote(dbname,safe=''):size})
+                item = (size, urllib.parse.quote(dbname,safe=''), fragmentation(sizes["file"], sizes["active"]))
+                if args.top and len(databases) >= args.top:
+                    heapq.heappushpop(databases, item)
+                else:
+                    heapq.heappush(databases, item)
+
+        if history:
+            history.commit()
+
+        #shard breakdown of listed databases instead of database sizes
+        if args.shards:
+            shard_report([urllib.parse.unquote(dbname) for size, dbname, ratio in sorted(databases)])
+            return
 
-        databases_sorted = sorted(databases, key=lambda x: databases[x])
-        for dbname in databases_sorted:
-            print("Name: %s | Size: %i Mb" % (dbname, databases[dbname]))
+        while databases:
+            size, dbname, ratio = heapq.heappop(databases)
+            print("Name: %s | Size: %i Mb | Fragmentation: %.1f%%" % (dbname, size, ratio*100))
 
     except LockTimeout:
         logger.info('Lock not acquired, exiting')
@@ -88,7 +288,16 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
     usage = "\n\ncouchdb_db_sizes.py [-I <instance URL>]\n\n"
             "Optional arguments:\n\n" \
-            "--min-size <int> Minimal database size to show in Mb. Default: 100 Mb\n\n",
+            "--min-size <int> Minimal database size to show in Mb. Default: 100 Mb\n\n" \
+            "--top <int> Show only given number of largest databases. Default: all\n\n" \
+            "--batch-size <int> Number of databases in one _dbs_info request. Default: 100\n\n" \
+            "--parallel <int> Number of parallel info requests on instances without _dbs_info. Default: 8\n\n" \
+            "--history <filename> SQLite file where sizes of all databases are appended on every run\n\n" \
+            "--report Rank compaction candidates by fragmentation, growth rate and projected size from history file without instance scan\n\n" \
+            "--days <int> Number of days for projected size in report. Default: 30\n\n" \
+            "--shards Show shard ranges, replica sizes by node and skew of listed databases\n\n" \
+            "--skew <float> Ratio of largest to mean range or node size flagged as skew. Default: 1.5\n\n" \
+            "--max-shard-size <int> Shard size in Mb above which database is flagged for resharding with higher q. Default: 10240 Mb\n\n",
         description='Couchdb database sizes script')
 
     parser.add_argument(
@@ -110,6 +319,91 @@ if __name__ == '__main__':
         help = "Minimal size of database in Mb to list. Default: 100 Mb"
     )
 
+    parser.add_argument(
+        "--top",
+        action = "store",
+        type = int,
+        dest = "top",
+        required = False,
+        default = int(0),
+        help = "Number of largest databases to list. Default: all"
+    )
+
+    parser.add_argument(
+        "--batch-size",
+        action = "store",
+        type = int,
+        dest = "batch_size",
+        required = False,
+        default = int(100),
+        help = "Number of databases in one _dbs_info request, must not exceed max_db_number_for_dbs_info_req of instance. Default: 100"
+    )
+
+    parser.add_argument(
+        "--parallel",
+        action = "store",
+        type = int,
+        dest = "parallel",
+        required = False,
+        default = int(8),
+        help = "Number of parallel database info requests on instances without _dbs_info. Default: 8"
+    )
+
+    parser.add_argument(
+        "--history",
+        action = "store",
+        type = str,
+        dest = "history",
+        required = False,
+        help = "SQLite file where file, active and external sizes and doc count of all databases are appended on every run"
+    )
+
+    parser.add_argument(
+        "--report",
+        action = "store_true",
+        dest = "report",
+        required = False,
+        help = "Show databases from history file ranked by size reclaimable by compaction with fragmentation, growth rate and projected size, instance is not scanned"
+    )
+
+    parser.add_argument(
+        "--days",
+        action = "store",
+        type = int,
+        dest = "days",
+        required = False,
+        default = int(30),
+        help = "Number of days for projected size in report. Default: 30"
+    )
+
+    parser.add_argument(
+        "--shards",
+        action = "store_true",
+        dest = "shards",
+        required = False,
+        help = "Collect _shards maps and shard file sizes on every node of listed databases in parallel, show sizes by range and node totals and flag skew"
+    )
+
+    parser.add_argument(
+        "--skew",
+        action = "store",
+        type = float,
+        dest = "skew",
+        required = False,
+        default = float(1.5),
+        help = "Ratio of largest to mean range size of database or node total size flagged as skew. Default: 1.5"
+    )
+
+    parser.add_argument(
+        "--max-shard-size",
+        action = "store",
+        type = int,
+        dest = "max_shard_size",
+        required = False,
+        default = int(10240),
+        help = "Shard size in Mb above which database is flagged for resharding with higher q. Default: 10240 Mb"
+    )
+
     args = parser.parse_args()
 
     main()
@@ -11,13 +11,20 @@
 
 
 import json
+import fnmatch
+import hashlib
 import logging
 import getpass
 import argparse
 import re
 import os
+import time
+import datetime
 import urllib
+import threading
 import couchdb
+from collections import namedtuple, Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from lockfile import FileLock, LockTimeout, AlreadyLocked
 from logging import handlers
 from urllib.parse import urlparse
@@ -30,16 +37,682 @@ class ContextFilter(logging.Filter):
         record.user = getpass.getuser()
         return True
 
+#couchdb servers of current thread, response cache of couchdb.Server is not thread safe
+thread_data = threading.local()
+
+def thread_server(url):
+    if not hasattr(thread_data, 'servers'):
+        thread_data.servers = {}
+    if url not in thread_data.servers:
+        thread_data.servers[url] = couchdb.Server(url)
+    return thread_data.servers[url]
+
+#replication document parsed once: source and target hosts, database name, continuous mode and state
+ReplicationDoc = namedtuple('ReplicationDoc', ['id', 'source', 'target', 'db_name', 'continuous', 'state'])
+
+def parse_endpoint(endpoint):
+    #host and database name from replication source or target
+    #created from web-ui: {"url": ...} with credentials in headers, created from script: url with credentials
+    url = urllib.parse.urlparse(endpoint['url'] if isinstance(endpoint, dict) else endpoint)
+    return url.netloc.rsplit('@',1)[-1], re.sub("/","",url.path)
+
+def parse_replication_doc(doc):
+    #returns None for replication document with unknown format
+    try:
+        src_url, src_db_name = parse_endpoint(doc['source'])
+        trg_url, trg_db_name = parse_endpoint(doc['target'])
+    except (KeyError, TypeError, AttributeError):
+        return None
+    if not (src_url and src_db_name and trg_url and trg_db_name):
+        return None
+    #database name is set only if source and target database names are equal
+    return ReplicationDoc(doc['_id'], src_url, trg_url, (src_db_name if src_db_name == trg_db_name else None),
+                          bool(doc.get('continuous')), doc.get('_replication_state'))
+
+def load_replication_docs(r_db):
+    #read replication documents by pages through _all_docs?include_docs=true in one pass
+    docs = []
+    startkey = None
+    while True:
+        options = {'include_docs': True, 'limit': args.page_size + 1}
+        if startkey is not None:
+            options['startkey'] = startkey
+        rows = list(r_db.view('_all_docs', **options))
+        for row in rows[:args.page_size]:
+            #skip service documents
+            if re.match(r'_', row.id) or row.doc is None:
+                continue
+            doc = parse_replication_doc(row.doc)
+            if doc is None:
+                print("Warning: replication document with \"%s\" id have unknown format...\n" % row.id)
+            else:
+                docs.append(doc)
+        if len(rows) <= args.page_size:
+            return docs
+        startkey = rows[-1].id
+
+#replication states of _scheduler/docs which will not change without new replication document
+FINISHED_STATES = ('completed', 'failed')
+
+def load_scheduler(r_couch, endpoint, key):
+    #read all rows of _scheduler/docs or _scheduler/jobs by pages
+    #couchdb resource quotes every path segment, so endpoint is passed as child resource
+    rows = []
+    while True:
+        status, headers, data = r_couch.resource(*endpoint.split('/')).get_json(limit=args.page_size, skip=len(rows))
+        rows.extend(data[key])
+        if len(data[key]) < args.page_size or len(rows) >= data.get('total_rows', len(rows) + 1):
+            return rows
+
+def load_scheduler_docs(r_couch):
+    #replication documents states from replication scheduler (CouchDB 2.1+)
+    #raises couchdb.http.ResourceNotFound on instances without scheduler
+    docs = []
+    for row in load_scheduler(r_couch, '_scheduler/docs', 'docs'):
+        if row.get('database') != '_replicator':
+            continue
+        doc = parse_replication_doc({'_id': row['doc_id'], 'source': row['source'], 'target': row['target'], '_replication_state': row['state']})
+        if doc is not None:
+            #continuous mode is not shown by scheduler, continuous replications are never completed
+            docs.append(doc._replace(continuous=False))
+    return docs
+
+def parse_time(value):
+    #scheduler timestamps like 2017-04-29T05:01:37Z
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=datetime.timezone.utc)
+
+def print_status(r_couch, source, target):
+    #print per database replication state, lag and throughput from replication scheduler
+    jobs = dict((job['doc_id'], job) for job in load_scheduler(r_couch, '_scheduler/jobs', 'jobs') if job.get('doc_id'))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    states = Counter()
+    print("\nReplication status from \"%s\" to \"%s\":\n" % (source,target))
+    print("%-40s %-12s %12s %12s %10s %s" % ('Database', 'State', 'Written', 'Pending', 'Docs/sec', 'Last updated'))
+    for row in load_scheduler(r_couch, '_scheduler/docs', 'docs'):
+        doc = parse_replication_doc({'_id': row['doc_id'], 'source': row['source'], 'target': row['target']})
+        if doc is None or doc.source != source or doc.target != target or not doc.db_name:
+            continue
+        states[row['state']] += 1
+        info = row.get('info') or {}
+        written = info.get('docs_written', 0)
+        #throughput since start of current job or since replication document was triggered
+        started = (jobs.get(row['doc_id']) or row).get('start_time')
+        duration = (now - parse_time(started)).total_seconds() if started else 0
+        print("%-40s %-12s %12i %12s %10.1f %s" % (doc.db_name, row['state'], written, info.get('changes_pending', '-'),
+                                                 (written/duration if duration > 0 else 0), row.get('last_updated', '-')))
+    print("\n%i replications total: %s\n" % (sum(states.values()), ', '.join('%s: %i' % (state, count) for state, count in sorted(states.items()))))
+
+def iter_all_dbs(couch):
+    #stream all database names of instance by pages of _all_dbs
+    startkey = None
+    while True:
+        params = {'limit': args.page_size + 1}
+        if startkey is not None:
+            params['startkey'] = json.dumps(startkey)
+        status, headers, data = couch.resource.get_json('_all_dbs', **params)
+        #instances without _all_dbs paging (couchdb 1.x) return all databases at once
+        if len(data) > args.page_size + 1 or (startkey is not None and data and data[0] < startkey):
+            for db_name in data:
+                if startkey is None or db_name >= startkey:
+                    yield db_name
+            return
+        for db_name in data[:args.page_size]:
+            yield db_name
+        if len(data) <= args.page_size:
+            return
+        startkey = data[-1]
+
+class DbMatcher(object):
+    #Database names rules from include or exclude file compiled once.
+    #Every line is exact database name, glob pattern with *, ? or [] or regular expression with "re:" prefix.
+    #Exact names are looked up in set, all patterns are joined to one alternation regex.
+
+    def __init__(self, filename):
+        self.rules = []
+        names = []
+        patterns = []
+        with open(filename) as f:
+            for line in f:
+                rule = line.strip()
+                if not rule:
+                    continue
+                self.rules.append(rule)
+                if rule.startswith('re:'):
+                    patterns.append('(?:%s)\\Z' % rule[3:])
+                elif any(c in rule for c in '*?['):
+                    patterns.append(fnmatch.translate(rule))
+                else:
+                    names.append(urllib.parse.unquote(rule))
+        #exact names in file order without duplicates
+        self.names = list(dict.fromkeys(names))
+        self.exact = set(self.names)
+        self.pattern = re.compile('|'.join(patterns)) if patterns else None
+
+    def match(self, db_name):
+        return db_name in self.exact or (self.pattern is not None and self.pattern.match(db_name) is not None)
+
+def seq_number(seq):
+    #numeric part of update sequence, sequences of CouchDB 2+ are like "123-g1AAAA..."
+    if isinstance(seq, int):
+        return seq
+    try:
+        return int(str(seq).split('-',1)[0])
+    except ValueError:
+        return None
+
+def format_eta(seconds):
+    if seconds is None:
+        return '-'
+    seconds = int(seconds)
+    return '%ih%02im%02is' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+def average_doc_size(s_couch, db_name):
+    #average document size in bytes of source database, used to estimate bytes/sec
+    try:
+        info = s_couch[urllib.parse.unquote(db_name)].info()
+    except Exception:
+        return None
+    size = info.get('sizes', {}).get('external', info.get('data_size', 0))
+    return (size / info['doc_count']) if info.get('doc_count') else None
+
+def watch_poll(r_couch, s_couch, source, target, replications, doc_sizes):
+    #one poll of _active_tasks and _scheduler/jobs, only replications with changed updated_on are recomputed
+    status, headers, tasks = r_couch.resource.get_json('_active_tasks')
+    try:
+        jobs = dict((job['id'], job) for job in load_scheduler(r_couch, '_scheduler/jobs', 'jobs'))
+    except couchdb.http.ResourceNotFound:
+        jobs = {}
+    seen = set()
+    for task in tasks:
+        if task.get('type') != 'replication':
+            continue
+        doc = parse_replication_doc({'_id': task.get('doc_id'), 'source': task.get('source'), 'target': task.get('target')})
+        if doc is None or doc.source != source or doc.target != target or not doc.db_name:
+            continue
+        rid = task.get('replication_id') or task.get('doc_id')
+        seen.add(rid)
+        job = jobs.get(rid) or {}
+        state = job['history'][0]['type'] if job.get('history') else 'running'
+        previous = replications.get(rid)
+        if previous and previous['updated_on'] == task.get('updated_on'):
+            previous['state'] = state
+            continue
+        if doc.db_name not in doc_sizes:
+            doc_sizes[doc.db_name] = average_doc_size(s_couch, doc.db_name)
+        written = task.get('docs_written', 0)
+        updated_on = task.get('updated_on', time.time())
+        #rate between two last updates or from replication start
+        if previous and updated_on > previous['updated_on']:
+            rate = (written - previous['docs_written']) / (updated_on - previous['updated_on'])
+        elif updated_on > task.get('started_on', updated_on):
+            rate = written / (updated_on - task['started_on'])
+        else:
+            rate = 0.0
+        source_seq = seq_number(task.get('source_seq'))
+        checkpointed_seq = seq_number(task.get('checkpointed_source_seq'))
+        pending = task.get('changes_pending')
+        replications[rid] = {'db_name': doc.db_name, 'state': state, 'updated_on': updated_on, 'docs_written': written,
+                             'rate': rate, 'bytes_rate': (rate * doc_sizes[doc.db_name] if doc_sizes[doc.db_name] else None),
+                             'pending': pending,
+                             'seq_lag': (source_seq - checkpointed_seq if source_seq is not None and checkpointed_seq is not None else None),
+                             'eta': (pending / rate if pending is not None and rate > 0 else None)}
+    #forget finished replications
+    for rid in list(replications):
+        if rid not in seen:
+            del replications[rid]
+
+def write_metrics(filename, replications):
+    #metrics in Prometheus text format, file is replaced atomically
+    lines = []
+    for name, key in (('docs_written', 'docs_written'), ('docs_per_second', 'rate'), ('bytes_per_second', 'bytes_rate'),
+                      ('changes_pending', 'pending'), ('checkpoint_seq_lag', 'seq_lag'), ('eta_seconds', 'eta')):
+        lines.append('# TYPE couchdb_replication_%s gauge' % name)
+        for rid in sorted(replications):
+            value = replications[rid][key]
+            if value is not None:
+                lines.append('couchdb_replication_%s{db="%s",replication_id="%s"} %s' % (name, replications[rid]['db_name'], rid, value))
+    with open(filename + '.tmp', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(filename + '.tmp', filename)
+
+def watch(r_couch, s_couch, source, target):
+    #poll replication tasks every --interval seconds and show refreshing table
+    replications = {}
+    doc_sizes = {}
+    try:
+        while True:
+            watch_poll(r_couch, s_couch, source, target, replications, doc_sizes)
+            rates = [r['rate'] for r in replications.values()]
+            bytes_rates = [r['bytes_rate'] for r in replications.values() if r['bytes_rate'] is not None]
+            pending = sum(r['pending'] or 0 for r in replications.values())
+            #clear screen and print table
+            print("\033[2J\033[H", end='')
+            print("Replication from \"%s\" to \"%s\" at %s (every %is, Ctrl+C to exit):\n" % (source,target,time.strftime('%Y-%m-%d %H:%M:%S'),args.interval))
+            print("%-40s %-10s %12s %10s %12s %12s %10s %12s" % ('Database', 'State', 'Written', 'Docs/sec', 'Kb/sec', 'Pending', 'Seq lag', 'ETA'))
+            for rid in sorted(replications, key=lambda rid: replications[rid]['db_name']):
+                r = replications[rid]
+                print("%-40s %-10s %12i %10.1f %12s %12s %10s %12s" % (r['db_name'], r['state'], r['docs_written'], r['rate'],
+                      ('%.1f' % (r['bytes_rate']/1024) if r['bytes_rate'] is not None else '-'),
+                      ('-' if r['pending'] is None else r['pending']), ('-' if r['seq_lag'] is None else r['seq_lag']), format_eta(r['eta'])))
+            print("\n%i replications: %.1f docs/sec, %.1f Kb/sec, %i changes pending, ETA %s" % (len(replications), sum(rates),
+                  sum(bytes_rates)/1024, pending, format_eta(pending / sum(rates) if sum(rates) > 0 else None)))
+            if args.metrics_file:
+                write_metrics(args.metrics_file, replications)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print("\nWatching stopped.\n")
+
+#replicator settings by source database size, first tier with max_size (Mb) and max_docs not less than database is used
+#tier without limits matches all databases
+TUNING_TIERS = [
+    {'name': 'small', 'max_size': 100, 'max_docs': 100000,
+        'settings': {'worker_processes': 1, 'worker_batch_size': 500, 'http_connections': 5, 'checkpoint_interval': 30000}},
+    {'name': 'medium', 'max_size': 10240, 'max_docs': 10000000,
+        'settings': {'worker_processes': 4, 'worker_batch_size': 500, 'http_connections': 20, 'checkpoint_interval': 30000}},
+    {'name': 'large',
+        'settings': {'worker_processes': 8, 'worker_batch_size': 2000, 'http_connections': 40, 'checkpoint_interval': 60000}},
+]
+
+#tuning tier of every database selected for replication, filled before replication starts
+db_tiers = {}
+
+def load_tuning_tiers(filename):
+    #tiers from JSON file with list in format of TUNING_TIERS
+    with open(filename) as f:
+        tiers = json.load(f)
+    if not tiers or tiers[-1].get('max_size') is not None or tiers[-1].get('max_docs') is not None:
+        tiers.append({'name': 'default', 'settings': {}})
+    return tiers
+
+def db_info(db_name):
+    #info of one source database by single GET request, None if database is not found
+    try:
+        status, headers, info = thread_server(args.s_instance).resource(urllib.parse.unquote(db_name)).get_json()
+        return info
+    except couchdb.http.ResourceNotFound:
+        return None
+
+def load_db_info(s_couch, databases):
+    #info of databases by _dbs_info requests of --info-batch-size databases (couchdb 2.2+)
+    #on older instances info of every database is requested by --parallel threads
+    #returns dict quoted name: info, databases which are not found are skipped
+    infos = {}
+    for i in range(0, len(databases), args.info_batch_size):
+        names = dict((urllib.parse.unquote(db_name), db_name) for db_name in databases[i:i + args.info_batch_size])
+        try:
+            status, headers, data = s_couch.resource.post_json('_dbs_info', body={'keys': list(names)})
+        except (couchdb.http.ResourceNotFound, couchdb.http.ServerError):
+            break
+        for row in data:
+            if row.get('info'):
+                infos[names[row['key']]] = row['info']
+    else:
+        return infos
+    remaining = databases[i:]
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        for db_name, info in zip(remaining, executor.map(db_info, remaining)):
+            if info:
+                infos[db_name] = info
+    return infos
+
+def tuning_tier(info, tiers):
+    #first tier which fits database file size and documents count
+    size = info.get('sizes', {}).get('file', info.get('disk_size', 0)) / 1024 / 1024
+    for tier in tiers:
+        if (tier.get('max_size') is None or size <= tier['max_size']) and (tier.get('max_docs') is None or info.get('doc_count', 0) <= tier['max_docs']):
+            return tier
+    return tiers[-1]
+
+def assign_tiers(s_couch, databases):
+    #find tuning tier of every database and print number of databases in every tier
+    tiers = load_tuning_tiers(args.tuning_file) if args.tuning_file else TUNING_TIERS
+    infos = load_db_info(s_couch, databases)
+    counts = Counter()
+    for db_name in databases:
+        tier = tuning_tier(infos.get(db_name, {}), tiers)
+        db_tiers[db_name] = tier
+        counts[tier['name']] += 1
+    print("Replication tuning tiers: %s\n" % ', '.join('%s: %i' % (tier['name'], counts[tier['name']]) for tier in tiers if counts[tier['name']]))
+
+def replication_doc_id(db_name):
+    #deterministic id from source and target hosts and database name without credentials
+    #rerun of the same plan conflicts with existing document instead of creating duplicate replication
+    source = urllib.parse.urlparse(args.s_instance).netloc.rsplit('@',1)[-1]
+    target = urllib.parse.urlparse(args.t_instance).netloc.rsplit('@',1)[-1]
+    return hashlib.sha1(('%s %s %s' % (source,target,db_name)).encode('utf-8')).hexdigest()
+
+def replication_doc(db_name):
+    #replication document for database with replicator settings of database tuning tier
+    doc = dict(db_tiers[db_name]['settings']) if db_name in db_tiers else {}
+    doc.update({'_id': replication_doc_id(db_name), 'source': '%s/%s' % (args.s_instance,db_name), 'target': '%s/%s' % (args.t_instance,db_name), 'create_target':True,'continuous':args.continuous})
+    return doc
+
+def delete_finished_doc(r_couch, r_db, doc_id):
+    #delete existing replication document with completed or failed replication, so it can be created again
+    #returns False if replication of existing document is still active
+    try:
+        if replication_state(r_couch, r_db, doc_id) not in FINISHED_STATES:
+            return False
+        r_db.delete(r_db[doc_id])
+    except couchdb.http.ResourceNotFound:
+        pass
+    return True
+
+def create_replication_docs(r_couch, r_db, databases, journal):
+    #write replication documents by _bulk_docs batches of --batch-size documents
+    #on conflict with document of completed or failed replication it is deleted and created again in second request,
+    #documents of active replications are counted as existing
+    c_count = 0
+    e_count = 0
+    f_count = 0
+    ts = time.time()
+    for i in range(0, len(databases), args.batch_size):
+        pending = databases[i:i + args.batch_size]
+        for attempt in (1, 2):
+            retry = []
+            for db_name, (success, doc_id, result) in zip(pending, r_db.update([replication_doc(db_name) for db_name in pending])):
+                if success:
+                    c_count += 1
+                    if journal:
+                        journal.write('completed', db_name, doc_id=doc_id)
+                elif isinstance(result, couchdb.http.ResourceConflict) and attempt == 1 and delete_finished_doc(r_couch, r_db, doc_id):
+                    print('Replication document \"%s\" for database \"%s\" has finished replication. Creating again...' % (doc_id,db_name))
+                    retry.append(db_name)
+                elif isinstance(result, couchdb.http.ResourceConflict):
+                    e_count += 1
+                    print('Replication document \"%s\" for database \"%s\" already exists and replication is active. Skipping...' % (doc_id,db_name))
+                    if journal:
+                        journal.write('completed', db_name, doc_id=doc_id, existing=True)
+                else:
+                    f_count += 1
+                    logger.info('Error: replication document for database %s not created: %s' % (db_name,result))
+                    print('Error: replication document for database \"%s\" not created: %s' % (db_name,result))
+                    if journal:
+                        journal.write('failed', db_name, doc_id=doc_id, error=str(result))
+            if not retry:
+                break
+            pending = retry
+        print('%i/%i: Replication documents created ...' % (min(i + args.batch_size, len(databases)),len(databases)))
+    duration = time.time() - ts
+    print ('\n%i replication documents created succesfully in %.1fs (%.1f documents/sec).' % (c_count,duration,(c_count/duration if duration else 0)))
+    if e_count:
+        print ('%i replication documents already exist with active replication.' % e_count)
+    if f_count:
+        print ('%i replication documents failed.' % f_count)
+
+def replicate_database(db_name):
+    #run one-shot replication of database
+    #returns number of documents written and estimated bytes moved: documents written by average document size of source
+    source_url = '%s/%s' % (args.s_instance,db_name)
+    target_url = '%s/%s' % (args.t_instance,db_name)
+    settings = db_tiers[db_name]['settings'] if db_name in db_tiers else {}
+    result = thread_server(args.r_instance).replicate(source_url, target_url, create_target=True, **settings)
+    #first history item is the last replication session
+    docs = sum(history.get('docs_written', 0) for history in result.get('history', [])[:1])
+    doc_size = average_doc_size(thread_server(args.s_instance), db_name) if docs else None
+    return docs, int(docs * (doc_size or 0))
+
+
+def probe_latency(s_couch):
+    #median time in seconds of three requests to source instance
+    times = []
+    for i in range(3):
+        ts = time.perf_counter()
+        s_couch.resource.get_json()
+        times.append(time.perf_counter() - ts)
+    return sorted(times)[1]
+
+def replication_state(r_couch, r_db, doc_id):
+    #state of replication document from scheduler or from document on instances without scheduler
+    try:
+        status, headers, data = r_couch.resource('_scheduler', 'docs', '_replicator', doc_id).get_json()
+        return data.get('state')
+    except couchdb.http.ResourceNotFound:
+        return r_db[doc_id].get('_replication_state')
+
+def adaptive_replication(r_couch, r_db, s_couch, databases, journal):
+    #keep target number of active replications, add replication documents when earlier ones finish
+    #and adjust target: additive increase while throughput grows and source latency is fine,
+    #multiplicative decrease when source latency rises
+    queue = list(databases)
+    active = {}
+    written = {}
+    t_count = 0
+    f_count = 0
+    d_count = 0
+    total = len(queue)
+    baseline = probe_latency(s_couch)
+    max_latency = (args.max_latency / 1000.0) if args.max_latency else baseline * 3
+    parallel = max(1, args.parallel)
+    best_rate = 0.0
+    ts = time.time()
+    last_poll = ts
+    print("Source latency baseline: %.1fms, latency limit: %.1fms\n" % (baseline*1000, max_latency*1000))
+    while queue or active:
+        #start new replications up to target concurrency
+        while queue and len(active) < parallel:
+            db_name = queue.pop(0)
+            doc = replication_doc(db_name)
+            existing = False
+            try:
+                r_db.save(doc)
+            except couchdb.http.ResourceConflict:
+                #document of finished replication is created again, active replication is followed as started one
+                if delete_finished_doc(r_couch, r_db, doc['_id']):
+                    r_db.save(replication_doc(db_name))
+                else:
+                    existing = True
+                    print('Replication document \"%s\" for database \"%s\" already exists and replication is active. Following it...' % (doc['_id'],db_name))
+            doc_id = doc['_id']
+            active[doc_id] = db_name
+            if journal:
+                journal.write('started', db_name, doc_id=doc_id, **({'existing': True} if existing else {}))
+        time.sleep(args.interval)
+
+        #throughput of active replications from docs_written increase since last poll
+        status, headers, tasks = r_couch.resource.get_json('_active_tasks')
+        now = time.time()
+        tasks = dict((task.get('doc_id'), task) for task in tasks if task.get('type') == 'replication' and task.get('doc_id') in active)
+        increase = 0
+        for doc_id, task in tasks.items():
+            increase += max(0, task.get('docs_written', 0) - written.get(doc_id, 0))
+            written[doc_id] = task.get('docs_written', 0)
+        d_count += increase
+        rate = increase / (now - last_poll)
+        last_poll = now
+
+        #finished replications: one-shot completed or continuous caught up with source
+        for doc_id in list(active):
+            state = replication_state(r_couch, r_db, doc_id)
+            caught_up = args.continuous and doc_id in tasks and tasks[doc_id].get('changes_pending') == 0
+            if state in FINISHED_STATES or caught_up:
+                db_name = active.pop(doc_id)
+                written.pop(doc_id, None)
+                if state == 'failed':
+                    f_count += 1
+                    print('Error: replication for database \"%s\" failed (document \"%s\")' % (db_name,doc_id))
+                    if journal:
+                        journal.write('failed', db_name, doc_id=doc_id)
+                else:
+                    t_count += 1
+                    print('%i/%i: Replication for database \"%s\" %s...' % (t_count,total,db_name,('caught up' if caught_up else 'completed')))
+                    if journal:
+                        journal.write('completed', db_name, doc_id=doc_id)
+
+        #adjust concurrency
+        latency = probe_latency(s_couch)
+        if latency > max_latency:
+            parallel = max(1, int(parallel * 0.75))
+        elif rate >= best_rate and len(active) >= parallel:
+            parallel = min(args.max_parallel, parallel + 1)
+        best_rate = max(best_rate, rate)
+        print('Active: %i, target: %i, queued: %i, source latency: %.1fms, %.1f docs/sec' % (len(active),parallel,len(queue),latency*1000,rate))
+
+    duration = time.time() - ts
+    print ('\n%i databases replicated succesfully in %.1fs.' % (t_count,duration))
+    print ('%i documents (%.1f docs/sec) written.' % (d_count,(d_count/duration if duration else 0)))
+    if f_count:
+        print ('%i databases failed.' % f_count)
+
+def select_databases(r_couch, r_db, s_couch, t_couch, source, target):
+    #list of quoted names of databases selected for replication
+    #include and exclude rules are compiled once and applied to database names while streaming _all_dbs
+    include = DbMatcher(args.i_filename) if args.i_filename else None
+    exclude = DbMatcher(args.e_filename) if args.e_filename else None
+    if include:
+        print("\nInclude list is set...\n")
+        if args.nonexistent:
+            print("\nReplicate only nonexistent databases from \"%s\" to \"%s\" included in \"%s\" file ...\nCreating list of nonexistent databases....\n" % (source,target,args.i_filename))
+            print("\nOnly following databases will be replicated if not exist:\n")
+        else:
+            print("\nReplicate databases from \"%s\" to \"%s\" included in \"%s\" file...\nCreating list of databases....\n" %(source,target,args.i_filename))
+            print("\nOnly following databases will be replicated:\n")
+        for rule in include.rules:
+            print ("\"%s\"" % rule)
+    elif args.nonexistent:
+        print("\nReplicate only nonexistent databases from \"%s\" to \"%s\" ...\nCreating list of nonexistent databases....\n" % (source,target))
+    else:
+        print("\nReplicate all databases from \"%s\" to \"%s\" ...\nCreating list of databases....\n" %(source,target))
+    if exclude:
+        print ("\nExlude list is set...\nFollowing databases will not be replicated:\n")
+        for rule in exclude.rules:
+            print ("\"%s\"" % rule)
+
+    #include file with exact names only does not need source databases listing
+    if include and include.pattern is None:
+        candidates = include.names
+    else:
+        candidates = (db_name for db_name in iter_all_dbs(s_couch) if include is None or include.match(db_name))
+
+    #fill databases with quoted names, skip service databases, excluded databases and duplicates, order is kept
+    databases = {}
+    e_count = 0
+    for db_name in candidates:
+        if db_name.startswith('_'):
+            continue
+        if exclude and exclude.match(db_name):
+            e_count += 1
+            continue
+        databases[urllib.parse.quote(db_name,safe='')] = None
+    if exclude:
+        print ("\n%i databases excluded from replication ...\n" % e_count)
+
+    if args.nonexistent:
+        #remove databases which exist on target instance while streaming target databases
+        for db_name in iter_all_dbs(t_couch):
+            databases.pop(urllib.parse.quote(db_name,safe=''), None)
+        if not include:
+            for db_name in databases:
+                print(db_name)
+        print ("\n%i databases from \"%s\" not exist on \"%s\" and allowed for replication ...\n" % (len(databases),source,target))
+    else:
+        print ("\n%i databases allowed for replication from \"%s\" to \"%s\" ...\n" % (len(databases),source,target))
+    databases = list(databases)
+
+    #get all databases that already have repliction documents in replication database
+    print("Check databases that already have active replication from \"%s\" to \"%s\" on replication server...\nCreating list of databases....\n" % (source,target))
+
+    #replication states from scheduler or from _replicator documents on instances without scheduler
+    try:
+        replication_docs = load_scheduler_docs(r_couch)
+    except couchdb.http.ResourceNotFound:
+        replication_docs = load_replication_docs(r_db)
+
+    #databases with active replication documents
+    active = {}
+    for doc in replication_docs:
+        #if source and target instance match with parameters and source and target database name is equal
+        if ((doc.source == source) and (doc.target == target) and doc.db_name):
+            #if continuos replication set in document - task is always active
+            #if replication state is not completed or failed - task is active
+            if (doc.continuous or doc.state not in FINISHED_STATES):
+                active.setdefault(doc.db_name, doc)
+
+    #delete databases with active replication from databases list
+    states = Counter()
+    for db_name in databases:
+        if db_name in active:
+            doc = active[db_name]
+            state = ('continuous' if doc.continuous else (doc.state or 'incomplete'))
+            states[state] += 1
+            print ("Database \"%s\" have %s replication running through replication document with id \"%s\". Skipping...\n" % (db_name,state,doc.id))
+    databases = [db_name for db_name in databases if db_name not in active]
+
+    print("%i databases have active replication (%s)\n%i databases not in replication yet\n" % (sum(states.values()),', '.join('%s: %i' % (state, count) for state, count in sorted(states.items())),len(databases)))
+
+    return databases
+
+class Journal(object):
+    #Append-only journal of replication run with one JSON line per event:
+    #planned, started, completed or failed database with timestamp.
+
+    def __init__(self, filename, source, target):
+        self.source = source
+        self.target = target
+        self.lock = threading.Lock()
+        self.f = open(filename, 'a+')
+        #terminate line partially written before crash
+        if self.f.tell() > 0:
+            self.f.seek(self.f.tell() - 1)
+            if self.f.read(1) != '\n':
+                self.f.write('\n')
+
+    def write(self, event, db_name, **fields):
+        entry = dict(fields, time=datetime.datetime.now().isoformat(), event=event, source=self.source, target=self.target, db=db_name)
+        with self.lock:
+            self.f.write(json.dumps(entry) + '\n')
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+def read_journal(filename, source, target):
+    #last event of every database from journal for source and target in planned order
+    events = {}
+    if not os.path.isfile(filename):
+        return events
+    with open(filename) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                #line partially written before crash
+                continue
+            if entry.get('source') == source and entry.get('target') == target:
+                events[entry['db']] = entry['event']
+    return events
+
+def replicate_with_retries(db_name, journal):
+    #replicate database, retry failures with exponential backoff and record every attempt in journal
+    for attempt in range(1, args.retries + 2):
+        if journal:
+            journal.write('started', db_name, attempt=attempt)
+        try:
+            docs, size = replicate_database(db_name)
+        except Exception as e:
+            if journal:
+                journal.write('failed', db_name, attempt=attempt, error=str(e))
+            if attempt > args.retries:
+                raise
+            print('Warning: replication for database \"%s\" failed (attempt %i): %s. Retrying...' % (db_name,attempt,e))
+            time.sleep(args.backoff * 2 ** (attempt - 1))
+            continue
+        if journal:
+            journal.write('completed', db_name, docs=docs, size=size, **({'tier': db_tiers[db_name]['name']} if db_name in db_tiers else {}))
+        return docs, size
 
 def main():
     try:
+        #watch mode is read only and long running, so it does not block replication runs with lock
+        if args.watch:
+            source = (urllib.parse.urlparse(args.s_instance).netloc).rsplit('@',1)[1]
+            target = (urllib.parse.urlparse(args.t_instance).netloc).rsplit('@',1)[1]
+            watch(couchdb.Server(args.r_instance), couchdb.Server(args.s_instance), source, target)
+            return
+
         # Ensure there are no paralell runs of this script
         lock.acquire(timeout=5)
-        #list of databases for replication
-        databases = []
         #created replication tasks counters
-        c_count=0
-        i_count=0
         t_count=0
 
         #replication tasks server
@@ -53,6 +726,15 @@ def main():
         target = (urllib.parse.urlparse(args.t_instance).netloc).rsplit('@',1)[1]
         t_couch = couchdb.Server(args.t_instance)
 
+        if (args.resume and not args.journal):
+            print("\nJournal file must be set with --journal to resume... Exiting...\n")
+            return
+
+        #show replication status only
+        if args.status:
+            print_status(r_couch, source, target)
+            return
+
         if (args.i_filename and not os.path.isfile(args.i_filename)):
             print("\nFile \"%s\" not found... Exiting...\n" % args.i_filename )
             raise SysExit
@@ -61,135 +743,69 @@ def main():
             print("\nFile \"%s\" not found... Exiting...\n" % args.e_filename )
             raise SysExit
 
-        #fill databases dict with all unique databases or only nonexistent
-        if args.nonexistent:
-            #find only databases which not exits on replication tasks instance
-            #if include file not set
-            if not args.i_filename:
-                print("\nReplicate only nonexistent databases from \"%s\" to \"%s\" ...\nCreating list of nonexistent databases....\n" % (source,target))
-                for db_name in s_couch:
-                    if ( not re.match(r'_', db_name) and db_name not in t_couch ):
-                        databases.append(urllib.parse.quote(db_name,safe=''))
-                for db_name in databases:
-                    print(db_name)
-            #if include file set - just check existance of databases from file
-            else:
-                print("\nInclude list is set...\n")
-                print("\nReplicate only nonexistent databases from \"%s\" to \"%s\" included in \"%s\" file ...\nCreating list of nonexistent databases....\n" % (source,target,args.i_filename))
-                print("\nOnly following databases will be replicated if not exist:\n")
-                f = open(args.i_filename)
-                for db_name in f:
-                    db_name = db_name.strip()
-                    print ("\"%s\"" % urllib.parse.quote(db_name,safe=''))
-                    if ( not re.match(r'_', db_name) and db_name not in t_couch ):
-                        databases.append(urllib.parse.quote(db_name,safe=''))
-                f.close()
-
-            print ("\n%i databases from \"%s\" not exist on \"%s\" and allowed for replication ...\n" % (len(databases),source,target))
+        if (args.tuning_file and not os.path.isfile(args.tuning_file)):
+            print("\nFile \"%s\" not found... Exiting...\n" % args.tuning_file )
+            raise SysExit
+
+        if args.resume:
+            #databases planned in previous run and not completed yet
+            events = read_journal(args.journal, source, target)
+            databases = [db_name for db_name, event in events.items() if event != 'completed']
+            print("\nResuming replication from \"%s\" to \"%s\" by journal \"%s\" ...\n%i databases completed, %i databases will be retried...\n" % (source,target,args.journal,len(events)-len(databases),len(databases)))
         else:
-            #if include file not set
-            if not args.i_filename:
-                print("\nReplicate all databases from \"%s\" to \"%s\" ...\nCreating list of databases....\n" %(source,target))
-                for db_name in s_couch:
-                    if ( not re.match(r'_', db_name) ):
-                        databases.append(urllib.parse.quote(db_name,safe=''))
-            #if include file set - just check existance of databases from file
-            else:
-                print("\nInclude list is set...\n")
-                print("\nReplicate databases from \"%s\" to \"%s\" included in \"%s\" file...\nCreating list of databases....\n" %(source,target,args.i_filename))
-                print("\nOnly following databases will be replicated:\n")
-                f = open(args.i_filename)
-                for db_name in f:
-                    db_name = db_name.strip()
-                    print ("\"%s\"" % urllib.parse.quote(db_name,safe=''))    
-                    if ( not re.match(r'_', db_name) ):
-                        databases.append(urllib.parse.quote(db_name,safe=''))
-                f.close()
-
-            print ("\n%i databases allowed for replication from \"%s\" to \"%s\" ...\n" % (len(databases),source,target))
-        #if exclude file is set
-        if args.e_filename:
-            print ("\nExlude list is set...\nFollowing databases will not be replicated:\n")
-            f = open(args.e_filename)
-            for db_name in f:
-                db_name = db_name.strip()
-                print ("\"%s\"" % urllib.parse.quote(db_name,safe=''))
-                if ( not re.match(r'_', db_name) and urllib.parse.quote(db_name,safe='') in databases ):
-                    databases.remove(urllib.parse.quote(db_name,safe=''))
-            f.close()
-            print ("\n%i databases allowed for replication from \"%s\" to \"%s\" ...\n" % (len(databases),source,target))
-
-        #get all databases that already have repliction documents in replication database
-        print("Check databases that already have active replication from \"%s\" to \"%s\" on replication server...\nCreating list of databases....\n" % (source,target))
-
-        #check active replication documents in _replicator db
-        for id in r_db:
-            #init temp vars
-            tmp_src_url = ""
-            tmp_src_db_name = ""
-            tmp_dst_url = ""
-            tmp_dst_db_name = ""
-
-            #if not service document
-            if (not re.match(r'_', id)):
-                #grab source,target and database name from replication document
-                #if created from web-ui
-                if ('url' in r_db[id]['source']):
-                    tmp_src_url = (urllib.parse.urlparse(r_db[id]['source']['url'])).netloc
-                    tmp_src_db_name = re.sub("/","",(urllib.parse.urlparse(r_db[id]['source']['url'])).path)
-                    tmp_trg_url = (urllib.parse.urlparse(r_db[id]['target']['url'])).netloc
-                    tmp_trg_db_name = re.sub("/","",(urllib.parse.urlparse(r_db[id]['target']['url'])).path)
-                #if created from script
-                elif ('@' in r_db[id]['source']):
-                        tmp_src_url = ((urllib.parse.urlparse(r_db[id]['source'])).netloc).rsplit('@',1)[1]
-                        tmp_src_db_name = re.sub("/","",(urllib.parse.urlparse(r_db[id]['source'])).path)
-                        tmp_trg_url = ((urllib.parse.urlparse(r_db[id]['target'])).netloc).rsplit('@',1)[1]
-                        tmp_trg_db_name = re.sub("/","",(urllib.parse.urlparse(r_db[id]['target'])).path)
-                else:
-                    print("Warning: replication document with \"%s\" id have unknown format...\n" % id)
-            #if replication document variables not empty
-            if (tmp_src_url and tmp_src_db_name and tmp_trg_url and tmp_trg_db_name):
-
-                #if source and target instance match with parameters and source and target database name is equal
-                if ((tmp_src_url == source) and (tmp_trg_url == target) and (tmp_src_db_name == tmp_trg_db_name)):
-                    #if continuos replication set in document - task is always active
-                    if (r_db[id]['continuous']):
-                        #if database name from document exists in databases list, then delete it from there
-                        if (tmp_src_db_name in databases):
-                            databases.remove(tmp_src_db_name)
-                            c_count +=1
-                            print ("Database \"%s\" have continuous replication running through replication document with id \"%s\". Skipping...\n" % (tmp_src_db_name,id))
-                        #if replication state is not completed
-                    elif (r_db[id]['_replication_state'] != "completed"):
-                        #if database name from document exists in databases list, then delete it from there
-                        if (tmp_src_db_name in databases):
-                            databases.remove(tmp_src_db_name)
-                            i_count +=1
-                            print ("Database \"%s\" have incomplete replication running through replication document with id \"%s\". Skipping...\n" % (tmp_src_db_name,id))
-
-        print("%i databases have active continuous replication\n%i databases have incompleted one-time replication\n%i databases not in replication yet\n" % (c_count,i_count,len(databases)))
+            databases = select_databases(r_couch, r_db, s_couch, t_couch, source, target)
 
         print("%i databases from %i selected databases will be replicated..." % ((args.t_count if args.t_count < len(databases) else len(databases)),len(databases)))
 
         #start creating replication tasks or documents
+        #tasks are running in parallel by --parallel workers, progress is printed on completion
         print("\nStarting replication tasks from  \"%s\" to \"%s\" ...\n" % (source,target))
-        for db_name in databases:
-            source_url = '%s/%s' % (args.s_instance,db_name)
-            target_url = '%s/%s' % (args.t_instance,db_name)
-            if args.continuous:
-                r_db.save({'source': source_url, 'target': target_url, 'create_target':True,'continuous':True})
-                t_count += 1
-                print('%i/%i: Replication document for database \"%s\" created ...' % (t_count,(args.t_count if args.t_count < len(databases) else len(databases)),db_name))
-            else:
-                r_couch.replicate(source_url, target_url, create_target=True)
-                t_count += 1
-                print('%i/%i: Replication for database \"%s\" completed...' % (t_count,(args.t_count if args.t_count < len(databases) else len(databases)),db_name))
-            if (t_count == args.t_count):
-                break
-        if args.continuous:
-            print ('\n%i replication documents created succesfully.' % t_count)
+        total = (args.t_count if args.t_count < len(databases) else len(databases))
+        if args.tuning or args.tuning_file:
+            assign_tiers(s_couch, databases[:total])
+        f_count = 0
+        d_count = 0
+        b_count = 0
+        #documents and databases replicated by tuning tier
+        tier_docs = Counter()
+        tier_dbs = Counter()
+        ts = time.time()
+        journal = Journal(args.journal, source, target) if args.journal else None
+        if journal and not args.resume:
+            for db_name in databases[:total]:
+                journal.write('planned', db_name)
+        if args.adaptive:
+            adaptive_replication(r_couch, r_db, s_couch, databases[:total], journal)
+        elif args.continuous:
+            create_replication_docs(r_couch, r_db, databases[:total], journal)
         else:
-            print ('\n%i databases replicated succesfully.' % t_count)
+            with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+                futures = dict((executor.submit(replicate_with_retries, db_name, journal), db_name) for db_name in databases[:total])
+                for future in as_completed(futures):
+                    db_name = futures[future]
+                    try:
+                        docs, size = future.result()
+                    except Exception as e:
+                        f_count += 1
+                        logger.info('Error: replication of database %s failed: %s' % (db_name,e))
+                        print('Error: replication for database \"%s\" failed: %s' % (db_name,e))
+                        continue
+                    t_count += 1
+                    d_count += docs
+                    b_count += size
+                    if db_name in db_tiers:
+                        tier_docs[db_tiers[db_name]['name']] += docs
+                        tier_dbs[db_tiers[db_name]['name']] += 1
+                    print('%i/%i: Replication for database \"%s\" completed (%i documents written)...' % (t_count,total,db_name,docs))
+            duration = time.time() - ts
+            print ('\n%i databases replicated succesfully in %.1fs.' % (t_count,duration))
+            print ('%i documents (%.1f docs/sec) and estimated %.1f Mb (%.2f Mb/sec) moved.' % (d_count,(d_count/duration if duration else 0),b_count/1024/1024,(b_count/1024/1024/duration if duration else 0)))
+            for tier in sorted(tier_dbs):
+                print ('Tier %s: %i databases, %i documents.' % (tier,tier_dbs[tier],tier_docs[tier]))
+            if f_count:
+                print ('%i databases failed.' % f_count)
+        if journal:
+            journal.close()
 
         #logger.info()
 
@@ -237,7 +853,25 @@ if __name__ == '__main__':
             "[--continuous ]  Optional parameter. Set if you need cotinuous replication tasks.\n\n" \
             "[--nonexistent ]  Optional parameter. Set if you need to replicate only databases which not exists on target instance.\n\n" \
             "[--include-db-file] Optional parameter. Set filename if you need to replicate only databases listed in text file line by line.\n\n" \
-            "[--exclude-db-file] Optional parameter. Set filename if you need to exlude from replication some databases listed in text file line by line.\n\n",
+            "[--exclude-db-file] Optional parameter. Set filename if you need to exlude from replication some databases listed in text file line by line.\n\n" \
+            "Lines of include and exclude files are exact database names, glob patterns (system_*, test/*) or regular expressions with \"re:\" prefix.\n\n" \
+            "[--parallel <count> ] Optional number of one-shot replications running at once or initial number of active replications in adaptive mode. Default: 1.\n\n" \
+            "[--batch-size <count> ] Optional number of replication documents in one _bulk_docs request in continuous mode. Default: 500.\n\n" \
+            "[--page-size <count> ] Optional number of rows in one page of paged requests. Default: 1000.\n\n" \
+            "[--journal <filename> ] Optional journal file with planned, started, completed and failed databases.\n\n" \
+            "[--resume ] Optional parameter. Replicate only not completed databases from journal of previous run.\n\n" \
+            "[--retries <count> ] Optional number of retries of failed replication. Default: 0.\n\n" \
+            "[--backoff <seconds> ] Optional delay before first retry, doubled for every next retry. Default: 10.\n\n" \
+            "[--watch ] Optional parameter. Monitor replication throughput, lag and ETA from _active_tasks and _scheduler/jobs.\n\n" \
+            "[--interval <seconds> ] Optional poll interval of watch mode. Default: 10.\n\n" \
+            "[--metrics-file <filename> ] Optional file with metrics in Prometheus text format updated by watch mode.\n\n" \
+            "[--adaptive ] Optional parameter. Create replication documents by adaptive scheduler which keeps target number of active replications.\n\n" \
+            "[--max-parallel <count> ] Optional maximal number of active replications in adaptive mode. Default: 32.\n\n" \
+            "[--max-latency <ms> ] Optional source latency limit in adaptive mode. Default: three times of latency before start.\n\n" \
+            "[--tuning ] Optional parameter. Set worker_processes, worker_batch_size, http_connections and checkpoint_interval of replications by source database size tier.\n\n" \
+            "[--tuning-file <filename> ] Optional JSON file with tuning tiers, implies --tuning.\n\n" \
+            "[--info-batch-size <count> ] Optional number of databases in one _dbs_info request of --tuning. Default: 100.\n\n" \
+            "[--status ] Optional parameter. Show replication state, lag and throughput of databases from replication scheduler and exit.\n\n",
         description='Couchdb replication script')
 
     parser.add_argument(
@@ -299,7 +933,7 @@ if __name__ == '__main__':
         type = str,
         dest = "i_filename",
         required = False,
-        help = "Optional parameter. Set filename if you need to replicate only databases listed in text file line by line.",
+        help = "Optional parameter. Set filename if you need to replicate only databases listed in text file line by line. Lines can be exact names, glob patterns or regular expressions with \"re:\" prefix.",
     )
 
     parser.add_argument(
@@ -308,7 +942,163 @@ if __name__ == '__main__':
         type = str,
         dest = "e_filename",
         required = False,
-        help = "Optional parameter. Set filename if you need to exlude from replication some databases listed in text file line by line.",
+        help = "Optional parameter. Set filename if you need to exlude from replication some databases listed in text file line by line. Lines can be exact names, glob patterns or regular expressions with \"re:\" prefix.",
+    )
+
+    parser.add_argument(
+        "--parallel",
+        action = "store",
+        type = int,
+        dest = "parallel",
+        required = False,
+        default = 1,
+        help = "Optional number of one-shot replications running at once or initial number of active replications in adaptive mode. Default: 1. ",
+    )
+
+    parser.add_argument(
+        "--batch-size",
+        action = "store",
+        type = int,
+        dest = "batch_size",
+        required = False,
+        default = 500,
+        help = "Optional number of replication documents written by one _bulk_docs request in continuous mode. Documents have ids derived from source, target and database name, so rerun of the same plan does not create duplicate replications. Default: 500. ",
+    )
+
+    parser.add_argument(
+        "--page-size",
+        action = "store",
+        type = int,
+        dest = "page_size",
+        required = False,
+        default = 1000,
+        help = "Optional number of rows in one page of paged requests. Default: 1000. ",
+    )
+
+    parser.add_argument(
+        "--status",
+        action='store_true',
+        dest = "status",
+        required = False,
+        help = "Optional parameter. Show replication state, pending changes and throughput of every database from _scheduler/docs and _scheduler/jobs and exit.",
+    )
+
+    parser.add_argument(
+        "--journal",
+        action = "store",
+        type = str,
+        dest = "journal",
+        required = False,
+        help = "Optional append-only journal file (JSON lines) with planned, started, completed and failed databases and timestamps.",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action='store_true',
+        dest = "resume",
+        required = False,
+        help = "Optional parameter. Skip databases listing and replication documents check and replicate only databases not completed in journal of previous run.",
+    )
+
+    parser.add_argument(
+        "--retries",
+        action = "store",
+        type = int,
+        dest = "retries",
+        required = False,
+        default = 0,
+        help = "Optional number of retries of failed replication of database. Default: 0. ",
+    )
+
+    parser.add_argument(
+        "--backoff",
+        action = "store",
+        type = float,
+        dest = "backoff",
+        required = False,
+        default = 10,
+        help = "Optional delay in seconds before first retry, doubled for every next retry. Default: 10. ",
+    )
+
+    parser.add_argument(
+        "--watch",
+        action='store_true',
+        dest = "watch",
+        required = False,
+        help = "Optional parameter. Poll _active_tasks and _scheduler/jobs and show per replication and total docs/sec, bytes/sec, pending changes, checkpoint sequence lag and estimated time to completion.",
+    )
+
+    parser.add_argument(
+        "--interval",
+        action = "store",
+        type = int,
+        dest = "interval",
+        required = False,
+        default = 10,
+        help = "Optional poll interval in seconds of watch mode. Default: 10. ",
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        action = "store",
+        type = str,
+        dest = "metrics_file",
+        required = False,
+        help = "Optional file with replication metrics in Prometheus text format, updated on every poll in watch mode.",
+    )
+
+    parser.add_argument(
+        "--adaptive",
+        action='store_true',
+        dest = "adaptive",
+        required = False,
+        help = "Optional parameter. Create replication documents by scheduler which keeps target number (starting from --parallel) of active replications, adds documents when earlier replications complete (or catch up in continuous mode) and adjusts target by source latency and _active_tasks throughput every --interval seconds.",
+    )
+
+    parser.add_argument(
+        "--max-parallel",
+        action = "store",
+        type = int,
+        dest = "max_parallel",
+        required = False,
+        default = 32,
+        help = "Optional maximal number of active replications in adaptive mode. Default: 32. ",
+    )
+
+    parser.add_argument(
+        "--max-latency",
+        action = "store",
+        type = float,
+        dest = "max_latency",
+        required = False,
+        help = "Optional source instance latency limit in milliseconds in adaptive mode, concurrency is decreased above it. Default: three times of latency before start.",
+    )
+
+    parser.add_argument(
+        "--tuning",
+        action='store_true',
+        dest = "tuning",
+        required = False,
+        help = "Optional parameter. Get doc count and file size of source databases by batched _dbs_info requests and set worker_processes, worker_batch_size, http_connections and checkpoint_interval of every replication from size tier (small up to 100Mb and 100000 documents, medium up to 10Gb and 10000000 documents, large).",
+    )
+
+    parser.add_argument(
+        "--tuning-file",
+        action = "store",
+        type = str,
+        dest = "tuning_file",
+        required = False,
+        help = "Optional JSON file with list of tuning tiers: [{\"name\": ..., \"max_size\": <Mb>, \"max_docs\": <count>, \"settings\": {\"worker_processes\": ..., ...}}, ...]. First matching tier is used, implies --tuning.",
+    )
+
+    parser.add_argument(
+        "--info-batch-size",
+        action = "store",
+        type = int,
+        dest = "info_batch_size",
+        required = False,
+        default = 100,
+        help = "Optional number of source databases in one _dbs_info request of --tuning, must not exceed max_db_number_for_dbs_info_req of instance. Default: 100. ",
     )
 
     args = parser.parse_args()